@@ -0,0 +1,217 @@
+"""Benchmarks for the cost of @pipes and the runtime of the code it generates
+
+Run from the repository root:
+
+    python benchmarks/bench_pipes.py --json results.json
+    python benchmarks/bench_pipes.py --compare results.json
+
+Every result is the best time per operation in microseconds. Only `pipes` and `_` are used,
+so the suite runs against older versions too and the JSON files can be compared across versions.
+The on-disk cache is disabled, decoration is always measured cold.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import types
+
+os.environ["JOFFPYPE_NO_CACHE"] = "1"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import joffpype  # noqa: E402
+from joffpype import _, pipes  # noqa: E402
+
+
+def best(stmt, number: int, repeat: int = 3) -> float:
+    """Returns the best time of `stmt` in microseconds per call"""
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number * 1e6
+
+
+def write_module(directory: str, name: str, source: str) -> str:
+    """Writes `source` to a module in `directory` and returns its path"""
+    path = os.path.join(directory, name + ".py")
+    with open(path, "w") as file:
+        file.write(source)
+    return path
+
+
+def load_module(directory: str, name: str, source: str):
+    """Writes `source` to a module in `directory` and imports it, so that getsource works"""
+    path = write_module(directory, name, source)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # Classes find their source through sys.modules
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def function_source(name: str, size: int, depth: int) -> str:
+    """A function of `size` statements, each a pipe chain of `depth` stages"""
+    chain = " >> ".join(["x"] + ["__ + 1"] * depth)
+    body = "".join(f"    y{i} = {chain}\n" for i in range(size))
+    return f"def {name}(x):\n{body}    return x\n"
+
+
+def class_source(name: str, methods: int, depth: int) -> str:
+    """A class of `methods` methods, each a single pipe chain of `depth` stages"""
+    chain = " >> ".join(["x"] + ["__ + 1"] * depth)
+    body = "".join(f"    def m{i}(self, x):\n        return {chain}\n" for i in range(methods))
+    return f"class {name}:\n{body}"
+
+
+def in_frames(depth: int, f):
+    """Calls `f` `depth` frames deep, as if decorating from within a deep call stack"""
+    if depth <= 1:
+        return f()
+    return in_frames(depth - 1, f)
+
+
+def bench_decoration(directory: str, quick: bool) -> dict:
+    results = {}
+    number = 5 if quick else 50
+
+    for size in (1, 10, 50):
+        for depth in (1, 5, 20):
+            name = f"f_{size}_{depth}"
+            module = load_module(directory, name, function_source(name, size, depth))
+            func = getattr(module, name)
+            results[f"function size={size} depth={depth}"] = best(lambda: pipes(func), number)
+
+    source = function_source("f", 10, 5)
+    functions = load_module(directory, "functions", source)
+    results["function 10x5"] = best(lambda: pipes(functions.f), number)
+
+    # Many decorated objects in one file, where locating each one's source shouldn't rescan the file
+    many = load_module(directory, "many", "".join(function_source(f"f{i}", 2, 2) for i in range(50)))
+    many_functions = [getattr(many, f"f{i}") for i in range(50)]
+    results["50 functions in one module"] = best(lambda: [pipes(func) for func in many_functions], number)
+
+    # The class is decorated where it is defined, as @pipes is applied to classes in practice
+    classes_source = "from joffpype import pipes\n@pipes\n" + class_source("C", 10, 5)
+    classes_path = write_module(directory, "classes", classes_source)
+    classes = compile(classes_source, classes_path, "exec")
+
+    def define_class():
+        # Runs the module's code like an import, classes find their source through sys.modules
+        module = sys.modules["classes"] = types.ModuleType("classes")
+        module.__file__ = classes_path
+        exec(classes, module.__dict__)  # pylint: disable=exec-used
+
+    for frames in (1, 50):
+        results[f"class 10x5 frames={frames}"] = best(lambda: in_frames(frames, define_class), number)
+    return results
+
+
+@pipes
+def piped_rshift(x):
+    return x >> __ + 1 >> abs >> __ * 2 >> str >> len
+
+
+def nested_rshift(x):
+    return len(str(abs(x + 1) * 2))
+
+
+@pipes
+def piped_lshift(x):
+    return x << __ + 1 << abs << __ * 2 << str << len
+
+
+@pipes
+def piped_infix(x):
+    return x |_| abs |_| str |_| len
+
+
+def runtime_infix(x):
+    return x |_| abs |_| str |_| len
+
+
+def nested_infix(x):
+    return len(str(abs(x)))
+
+
+def expensive(x):
+    return sum(range(x))
+
+
+@pipes
+def piped_multi_sub(x):
+    return x >> expensive(__) >> (__, __, __) >> len
+
+
+def nested_multi_sub(x):
+    y = expensive(x)
+    return len((y, y, y))
+
+
+def bench_runtime(quick: bool) -> dict:
+    number = 20000 if quick else 200000
+    cases = {
+        ">> chain": piped_rshift,
+        "<< chain": piped_lshift,
+        ">> nested": nested_rshift,
+        "|_| chain in @pipes": piped_infix,
+        "|_| chain at runtime": runtime_infix,
+        "|_| nested": nested_infix,
+    }
+    results = {name: best(lambda f=f: f(5), number) for name, f in cases.items()}
+
+    number //= 10
+    results["multiple __ piped"] = best(lambda: piped_multi_sub(200), number)
+    results["multiple __ nested"] = best(lambda: nested_multi_sub(200), number)
+    return results
+
+
+def run(quick: bool) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        decoration = bench_decoration(directory, quick)
+    return {
+        "meta": {
+            "joffpype": getattr(joffpype, "__version__", "unknown"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "quick": quick,
+        },
+        "decoration": decoration,
+        "runtime": bench_runtime(quick),
+    }
+
+
+def report(results: dict, baseline: dict = None) -> None:
+    meta = results["meta"]
+    print(f"joffpype {meta['joffpype']} on {meta['implementation']} {meta['python']}, microseconds per operation")
+    for group in ("decoration", "runtime"):
+        print(f"\n{group}")
+        for name, value in results[group].items():
+            line = f"  {name:<32} {value:12.3f}"
+            old = (baseline or {}).get(group, {}).get(name)
+            if old:
+                line += f"  {old:12.3f}  {value / old:6.2f}x"
+            print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="compare against results written earlier with --json")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, for a rough picture")
+    args = parser.parse_args()
+
+    results = run(args.quick)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    report(results, baseline)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
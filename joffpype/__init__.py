@@ -1,5 +1,10 @@
 """Superpipe extended"""
 
+__version__ = "1.1.0"
+
 from .superpipe import pipes
 #from .utils import cube, foreach, is_even, is_falsy, is_none, is_not_none, is_odd, is_truthy, square
 from .infix import _
+from .importer import install, uninstall
+from .profiling import stats
+from .pipelines import Pipeline, memo, pipeline
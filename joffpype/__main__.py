@@ -0,0 +1,37 @@
+"""Command line interface, e.g. `python -m joffpype compile src/ -o build/`"""
+
+import argparse
+import sys
+
+from .compiler import compile_tree
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m joffpype")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = commands.add_parser(
+        "compile", help="write a copy of a source tree with the pipe operator compiled away"
+    )
+    compile_parser.add_argument("src", help="source directory")
+    compile_parser.add_argument("-o", "--out", required=True, help="output directory")
+    compile_parser.add_argument(
+        "--all", action="store_true", help="apply the pipe operator to every module, as if each had the marker comment"
+    )
+    compile_parser.add_argument("--force", action="store_true", help="rebuild every file, not only the changed ones")
+    compile_parser.add_argument("-q", "--quiet", action="store_true", help="don't list the rebuilt files")
+
+    args = parser.parse_args(argv)
+    log = None if args.quiet else print
+    try:
+        rebuilt = compile_tree(args.src, args.out, whole_module=args.all, force=args.force, log=log)
+    except (OSError, SyntaxError) as error:
+        print(f"joffpype: {error}", file=sys.stderr)
+        return 1
+    if not args.quiet:
+        print(f"{len(rebuilt)} file(s) rebuilt")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Async pipeline stages
+
+Inside an `async def` decorated with @pipes, stages that call coroutine functions are awaited automatically,
+and any stage can be marked as async explicitly with `await`:
+
+    from joffpype.aio import amap
+
+    @pipes
+    async def handler(request):
+        return request >> await read_body >> parse >> __.urls >> amap(fetch, concurrency=10)
+
+Coroutine functions are detected by name: those defined at the top level of the same module, those defined
+inside the decorated code, and those bound in its globals when the decorator runs. Other stages, e.g. methods,
+have to be marked with `await`. Names rebound by a parameter or assignment of the enclosing function are not awaited,
+and neither are stages in comprehensions, whose coroutines are meant to be gathered.
+"""
+
+import asyncio
+from inspect import isawaitable
+from itertools import islice
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar, Union
+
+T = TypeVar("T")
+S = TypeVar("S")
+
+
+async def amap(
+    iterable: Union[Iterable[T], AsyncIterable[T]],
+    f: Callable[[T], Union[Awaitable[S], S]],
+    concurrency: int = 8,
+) -> List[S]:
+    """
+    Applies `f` to each element of `iterable`, with at most `concurrency` calls of `f` awaited at once.
+    `f` may be a coroutine function or a regular function, and `iterable` may be async.
+    Elements are pulled from `iterable` as workers become free. Returns the results in the order of `iterable`.
+    If a call fails, the other calls are cancelled and the exception is raised.
+    """
+    results: Dict[int, S] = {}
+    index = 0
+
+    if hasattr(iterable, "__aiter__"):
+        iterator = iterable.__aiter__()
+        # Async generators don't allow concurrent __anext__ calls
+        lock = asyncio.Lock()
+
+        async def pull() -> Optional[Tuple[int, Any]]:
+            nonlocal index
+            async with lock:
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return None
+                index += 1
+                return index - 1, item
+
+    else:
+        iterator = iter(iterable)
+
+        async def pull() -> Optional[Tuple[int, Any]]:
+            nonlocal index
+            # StopIteration must not escape a coroutine
+            for item in islice(iterator, 1):
+                index += 1
+                return index - 1, item
+            return None
+
+    async def worker() -> None:
+        while True:
+            pulled = await pull()
+            if pulled is None:
+                return
+            position, item = pulled
+            result = f(item)
+            if isawaitable(result):
+                result = await result
+            results[position] = result
+
+    tasks = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return [results[position] for position in range(len(results))]
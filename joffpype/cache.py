@@ -0,0 +1,193 @@
+"""Persistent on-disk cache for the code objects generated by @pipes.
+
+Entries are content addressed: the key is a hash of the decorated object's source file,
+its location in that file, the Python bytecode tag, the optimization level and the joffpype version. A warm start
+can therefore skip getsource, parse, the transformation and compile altogether.
+
+Configuration happens through environment variables:
+
+- JOFFPYPE_NO_CACHE: set to any non-empty value to disable the cache
+- JOFFPYPE_CACHE_DIR: directory for cache entries (default: $XDG_CACHE_HOME/joffpype or ~/.cache/joffpype)
+- JOFFPYPE_CACHE_MAX_SIZE: size cap in bytes, least recently used entries are evicted first (default: 64 MiB)
+"""
+
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import typing
+from types import CodeType
+
+from . import __version__
+
+ENV_DISABLE: str = "JOFFPYPE_NO_CACHE"
+ENV_DIR: str = "JOFFPYPE_CACHE_DIR"
+ENV_MAX_SIZE: str = "JOFFPYPE_CACHE_MAX_SIZE"
+DEFAULT_MAX_SIZE: int = 64 * 1024 * 1024
+
+SUFFIX: str = ".jpc"
+
+# path -> (mtime_ns, size, hexdigest), so that a file is hashed once per process
+_file_digests: typing.Dict[str, typing.Tuple[int, int, str]] = {}
+# running estimate of the cache size, so that stores don't have to rescan the directory
+_cache_size: typing.Optional[int] = None
+
+
+def enabled() -> bool:
+    """Whether the cache is used at all"""
+    return not os.environ.get(ENV_DISABLE)
+
+
+def cache_dir() -> str:
+    """The directory cache entries are read from and written to"""
+    path = os.environ.get(ENV_DIR)
+    if path:
+        return path
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "joffpype")
+
+
+def max_size() -> int:
+    """The size cap of the cache directory in bytes"""
+    try:
+        return int(os.environ.get(ENV_MAX_SIZE, DEFAULT_MAX_SIZE))
+    except ValueError:
+        return DEFAULT_MAX_SIZE
+
+
+def file_digest(path: typing.Optional[str]) -> typing.Optional[str]:
+    """
+    Returns the sha256 of the file at `path`, or None if it is not a regular file.
+    Digests are memoized per process and revalidated with the file's mtime and size.
+    """
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    cached = _file_digests.get(path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    try:
+        with open(path, "rb") as file:
+            digest = source_digest(file.read())
+    except OSError:
+        return None
+    _file_digests[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def source_digest(source: bytes) -> str:
+    """Returns the sha256 of `source`, for callers that have already read the file"""
+    return hashlib.sha256(source).hexdigest()
+
+
+def make_key(digest: typing.Optional[str], *parts, optimize: typing.Optional[int] = None) -> typing.Optional[str]:
+    """
+    Builds the cache key for code generated from the source with the given `digest`.
+    `parts` must identify the generated code within that source, e.g. the line number and name.
+    `optimize` is the optimization level the code is compiled with, by default the interpreter's (`-O`).
+    Returns None if the cache is disabled or there is no digest.
+    """
+    if not enabled() or digest is None:
+        return None
+    tag = sys.implementation.cache_tag or sys.version
+    # Like the .opt-N of __pycache__, code compiled with -O lacks asserts and must not be shared
+    level = sys.flags.optimize if optimize is None or optimize < 0 else optimize
+    material = "\0".join([tag, f"opt-{level}", __version__, digest] + [str(part) for part in parts])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(cache_dir(), key + SUFFIX)
+
+
+def load(key: str) -> typing.Optional[CodeType]:
+    """Returns the cached code object for `key`, or None on a miss or a corrupt entry"""
+    path = _entry_path(key)
+    try:
+        with open(path, "rb") as file:
+            code = marshal.load(file)
+        # Refresh the entry's mtime, which the eviction uses as its recency
+        os.utime(path)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return code if isinstance(code, CodeType) else None
+
+
+def store(key: str, code: CodeType) -> None:
+    """Writes `code` to the cache. Failures are ignored, the cache is only an optimization."""
+    global _cache_size
+
+    if sys.dont_write_bytecode:
+        return
+    directory = cache_dir()
+    data = marshal.dumps(code)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, _entry_path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        return
+
+    if _cache_size is None:
+        _cache_size = sum(size for _, _, size in _entries(directory))
+    else:
+        _cache_size += len(data)
+    if _cache_size > max_size():
+        evict()
+
+
+def _entries(directory: str) -> typing.List[typing.Tuple[float, str, int]]:
+    """Returns (mtime, path, size) for every cache entry in `directory`"""
+    entries = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return entries
+    for name in names:
+        if not name.endswith(SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, path, st.st_size))
+    return entries
+
+
+def evict(target: typing.Optional[int] = None) -> None:
+    """
+    Removes the least recently used entries until the cache is no larger than `target` bytes.
+    By default this frees up a quarter of the size cap, so that eviction doesn't run on every store.
+    """
+    global _cache_size
+
+    if target is None:
+        target = max_size() * 3 // 4
+    entries = sorted(_entries(cache_dir()))
+    size = sum(entry[2] for entry in entries)
+    for _, path, entry_size in entries:
+        if size <= target:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        size -= entry_size
+    _cache_size = size
+
+
+def clear() -> None:
+    """Removes every entry from the cache"""
+    evict(0)
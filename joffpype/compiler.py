@@ -0,0 +1,257 @@
+"""Ahead-of-time compilation of source trees into plain Python without pipes.
+
+    python -m joffpype compile src/ -o build/
+
+Every module is written to the output directory with the pipe operator already applied, the way
+@pipes or the import hook would have applied it, and with the @pipes decorators removed. The result
+runs without decoration, AST work, `inspect` or the original sources. Modules that use neither
+@pipes nor the `# joffpype: pipes` marker, and all other files, are copied unchanged.
+
+The generated code is written with `ast.unparse`, so comments and formatting are lost, but every
+statement is placed on its original line where possible, so tracebacks point at the right lines.
+Rebuilds are incremental: a file is only regenerated if its mtime or size changed and its contents did.
+"""
+
+import json
+import os
+import re
+import shutil
+import typing
+from ast import (
+    AST,
+    AsyncFunctionDef,
+    ClassDef,
+    Expr,
+    If,
+    ImportFrom,
+    Load,
+    Module,
+    Name,
+    NodeTransformer,
+    fix_missing_locations,
+    parse,
+    stmt,
+    unparse,
+    walk,
+)
+
+from . import __version__
+from . import cache as _cache
+from .importer import MARKER, MARKER_SCAN_BYTES
+from .superpipe import INFIX_IDENT, TEMP_PREFIX, _transform, is_pipes_decorator
+
+MANIFEST: str = ".joffpype-build.json"
+SKIP_DIRS: typing.Tuple[str, ...] = ("__pycache__",)
+# Imports of these names from these modules are dropped once the names are compiled away
+MODULES: typing.Tuple[str, ...] = ("joffpype", "joffpype.superpipe", "joffpype.infix")
+COMPILED_NAMES: typing.Tuple[str, ...] = ("pipes", INFIX_IDENT)
+# Fields of statements and handlers that hold a block of statements
+STATEMENT_FIELDS: typing.Tuple[str, ...] = ("body", "orelse", "finalbody")
+LINE_MARKER: str = f"{TEMP_PREFIX}line_"
+_LINE_MARKER_RE = re.compile(rf"\s*{LINE_MARKER}(\d+)")
+
+
+def _is_elif(node: If) -> bool:
+    # elif starts at the column of its if, an if nested in else is indented further
+    return (
+        len(node.orelse) == 1
+        and isinstance(node.orelse[0], If)
+        and getattr(node.orelse[0], "col_offset", None) == getattr(node, "col_offset", None)
+    )
+
+
+def _line_marker(line: int) -> Expr:
+    return Expr(Name(f"{LINE_MARKER}{line}", Load()))
+
+
+def _unparse(tree: Module) -> str:
+    """
+    Unparses `tree` with `ast.unparse`, padded with blank lines so that statements start on their original line.
+    Where the generated code is longer than the original, later statements are shifted until
+    a gap in the original lets the output catch up again.
+    """
+    # Every statement is preceded by a marker holding its line, which is unparsed on a line of its own.
+    # The headers of elif and except are padded by a marker at the end of the block before them
+    for node in list(walk(tree)):
+        for field in STATEMENT_FIELDS:
+            body = getattr(node, field, None)
+            if not isinstance(body, list) or not body or not isinstance(body[0], stmt):
+                continue
+            if field == "orelse" and isinstance(node, If) and _is_elif(node):
+                # A marker would turn elif into else and if
+                continue
+            marked = []
+            for statement in body:
+                if hasattr(statement, "lineno"):
+                    decorators = getattr(statement, "decorator_list", ())
+                    marked.append(_line_marker(min([statement.lineno] + [dec.lineno for dec in decorators])))
+                marked.append(statement)
+            setattr(node, field, marked)
+        if isinstance(node, If) and _is_elif(node) and hasattr(node.orelse[0], "lineno"):
+            node.body.append(_line_marker(node.orelse[0].lineno))
+        handlers = getattr(node, "handlers", None)
+        if handlers:
+            for block, handler in zip([node.body] + [handler.body for handler in handlers], handlers):
+                if hasattr(handler, "lineno"):
+                    block.append(_line_marker(handler.lineno))
+
+    lines: typing.List[str] = []
+    after_marker = False
+    for line in unparse(fix_missing_locations(tree)).splitlines():
+        marker = _LINE_MARKER_RE.fullmatch(line)
+        if marker is not None:
+            lines.extend([""] * (int(marker.group(1)) - 1 - len(lines)))
+        elif line or not after_marker:
+            # unparse separates definitions with a blank line, the padding takes its place
+            lines.append(line)
+        after_marker = marker is not None or (after_marker and not line)
+    return "\n".join(lines)
+
+
+class _DecoratedTransformer(NodeTransformer):
+    """Applies the pipe operator to every definition decorated with @pipes, wherever it is nested"""
+
+    def __init__(self, async_names: typing.AbstractSet[str]):
+        self.async_names = async_names
+        self.changed = False
+
+    def _visit_definition(self, node):
+        if not any(is_pipes_decorator(dec) for dec in node.decorator_list):
+            return self.generic_visit(node)
+        self.changed = True
+        return _transform(Module(body=[node], type_ignores=[]), self.async_names).body[0]
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _visit_definition
+
+
+def _module_async_names(tree: AST) -> typing.FrozenSet[str]:
+    """
+    Returns the names of the coroutine functions defined in `tree` outside of class bodies.
+    At compile time these are the only coroutine functions known by name, stages calling
+    imported ones have to be awaited explicitly with `x >> await f`.
+    """
+    methods = set()
+    for node in walk(tree):
+        if isinstance(node, ClassDef):
+            methods.update(id(stmt) for stmt in node.body)
+    return frozenset(
+        node.name for node in walk(tree) if isinstance(node, AsyncFunctionDef) and id(node) not in methods
+    )
+
+
+def _drop_unused_imports(tree: Module) -> None:
+    """Removes top level imports of `pipes` and `_` from joffpype that nothing refers to anymore"""
+    used = {node.id for node in walk(tree) if isinstance(node, Name)}
+    unused = {name for name in COMPILED_NAMES if name not in used}
+    body = []
+    for stmt in tree.body:
+        if isinstance(stmt, ImportFrom) and stmt.level == 0 and stmt.module in MODULES:
+            stmt.names = [alias for alias in stmt.names if alias.asname is not None or alias.name not in unused]
+            if not stmt.names:
+                continue
+        body.append(stmt)
+    tree.body = body
+
+
+def compile_source(source: bytes, filename: str, whole_module: bool = False) -> typing.Optional[str]:
+    """
+    Returns the pipe-free source of the module `source`, or None if it doesn't use pipes at all.
+    :param filename: Name of the module's file, used in syntax errors
+    :param whole_module: Whether to apply the pipe operator to the whole module, as if it had the marker comment
+    """
+    tree = parse(source, filename=filename)
+    if whole_module or MARKER.search(source[:MARKER_SCAN_BYTES]):
+        tree = _transform(tree)
+    else:
+        transformer = _DecoratedTransformer(_module_async_names(tree))
+        tree = transformer.visit(tree)
+        if not transformer.changed:
+            return None
+    _drop_unused_imports(tree)
+    return _unparse(tree) + "\n"
+
+
+def _load_manifest(path: str, whole_module: bool) -> typing.Dict[str, dict]:
+    try:
+        with open(path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    # Output of another version or mode is rebuilt from scratch
+    if manifest.get("joffpype") != __version__ or manifest.get("all") != whole_module:
+        return {}
+    return manifest.get("files", {})
+
+
+def _source_files(src: str, out: str) -> typing.Iterator[str]:
+    """Yields the paths of all files below `src`, relative to it, skipping `out` if it is inside `src`"""
+    out = os.path.realpath(out)
+    for root, dirs, files in os.walk(src):
+        dirs[:] = sorted(
+            name
+            for name in dirs
+            if name not in SKIP_DIRS and os.path.realpath(os.path.join(root, name)) != out
+        )
+        for name in sorted(files):
+            yield os.path.relpath(os.path.join(root, name), src)
+
+
+def compile_tree(
+    src: str,
+    out: str,
+    whole_module: bool = False,
+    force: bool = False,
+    log: typing.Optional[typing.Callable[[str], None]] = None,
+) -> typing.List[str]:
+    """
+    Writes a pipe-free copy of the source tree `src` to `out`.
+    :param whole_module: Whether to apply the pipe operator to every module, as if each had the marker comment
+    :param force: Whether to rebuild every file, instead of only those that changed since the last build
+    :param log: Called with the relative path of every file that is rebuilt
+    :returns: The relative paths of the files that were rebuilt
+    """
+    manifest_path = os.path.join(out, MANIFEST)
+    previous = {} if force else _load_manifest(manifest_path, whole_module)
+    files = {}
+    rebuilt = []
+
+    for relpath in _source_files(src, out):
+        source_path = os.path.join(src, relpath)
+        out_path = os.path.join(out, relpath)
+        st = os.stat(source_path)
+        entry = previous.get(relpath)
+        exists = os.path.exists(out_path)
+
+        # mtime and size first, the hash only decides for files that were touched
+        if exists and entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            files[relpath] = entry
+            continue
+        with open(source_path, "rb") as file:
+            data = file.read()
+        digest = _cache.source_digest(data)
+        files[relpath] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "digest": digest}
+        if exists and entry and entry["digest"] == digest:
+            continue
+
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        generated = compile_source(data, source_path, whole_module) if relpath.endswith(".py") else None
+        if generated is None:
+            shutil.copyfile(source_path, out_path)
+        else:
+            with open(out_path, "w", encoding="utf-8") as file:
+                file.write(generated)
+        rebuilt.append(relpath)
+        if log is not None:
+            log(relpath)
+
+    # Remove the output of files that have been deleted since the last build
+    for relpath in previous.keys() - files.keys():
+        try:
+            os.unlink(os.path.join(out, relpath))
+        except OSError:
+            pass
+
+    os.makedirs(out, exist_ok=True)
+    with open(manifest_path, "w") as file:
+        json.dump({"joffpype": __version__, "all": whole_module, "files": files}, file, indent=1)
+    return rebuilt
@@ -0,0 +1,127 @@
+"""Import hook that enables the pipe operator for whole modules at import time.
+
+Instead of decorating every function with @pipes, a module can opt in as a whole, either
+by containing the marker comment `# joffpype: pipes` on a line of its own, or by belonging
+to one of the packages passed to `install`. Selected modules are parsed once, transformed
+once and compiled once, and the result is kept in the same on-disk cache as @pipes uses.
+
+    import joffpype
+    joffpype.install("mypackage")
+
+    import mypackage.etl  # >> is a pipe everywhere in mypackage
+
+Only modules imported after `install` are affected. With the marker enabled, which is the default,
+every import that reaches the hook costs an extra lookup of the module's file and a read of its first
+4 KB, the standard library excepted. Pass `marker=False` to `install` to avoid that cost where only
+whole packages need the pipe operator.
+"""
+
+import os
+import re
+import sys
+import sysconfig
+import typing
+from ast import parse
+from importlib.abc import MetaPathFinder
+from importlib.machinery import PathFinder, SourceFileLoader
+
+from . import cache as _cache
+from . import profiling
+from .superpipe import _transform
+
+MARKER = re.compile(rb"^[ \t]*#[ \t]*joffpype:[ \t]*pipes[ \t]*\r?$", re.MULTILINE)
+
+# Only the head of a module is scanned for the marker comment
+MARKER_SCAN_BYTES: int = 4096
+
+
+class PipeLoader(SourceFileLoader):
+    """Loads a source module with the pipe operator enabled throughout"""
+
+    def get_code(self, fullname):
+        path = self.get_filename(fullname)
+        source = self.get_data(path)
+
+        # The regular bytecode cache is bypassed on purpose, a __pycache__ entry
+        # written without the hook would otherwise be picked up untransformed
+        # Code compiled with -O lacks asserts, so the optimization level is part of the key
+        optimize = sys.flags.optimize
+        key = _cache.make_key(
+            _cache.source_digest(source), path, "<module>", profiling.stages_enabled(), optimize=optimize
+        )
+        code = _cache.load(key) if key is not None else None
+        if code is None:
+            code = self.source_to_code(source, path, _optimize=optimize)
+            if key is not None:
+                _cache.store(key, code)
+        return code
+
+    def source_to_code(self, data, path, *, _optimize=-1):
+        stage_file = path if profiling.stages_enabled() else None
+        tree = _transform(parse(data, filename=path), stage_file=stage_file)
+        return compile(tree, path, "exec", dont_inherit=True, optimize=_optimize)
+
+    def exec_module(self, module):
+        if profiling.stages_enabled():
+            profiling.install_hooks(module.__dict__)
+        super().exec_module(module)
+
+
+class PipeFinder(MetaPathFinder):
+    """
+    Meta path finder that hands selected source modules to `PipeLoader`.
+    A module is selected if it is part of one of `packages`, or if `marker` is set
+    and the module contains the marker comment.
+    """
+
+    def __init__(self, packages: typing.Iterable[str] = (), marker: bool = True):
+        self.packages = tuple(packages)
+        self.marker = marker
+        paths = sysconfig.get_paths()
+        self._stdlib = tuple(os.path.join(paths[key], "") for key in ("stdlib", "platstdlib"))
+        # Outside of virtual environments, site-packages is inside the standard library directory
+        self._site = tuple(os.path.join(paths[key], "") for key in ("purelib", "platlib"))
+
+    def _in_packages(self, fullname: str) -> bool:
+        return any(fullname == pkg or fullname.startswith(pkg + ".") for pkg in self.packages)
+
+    def _has_marker(self, origin: str) -> bool:
+        # The standard library never opts in, no need to read it
+        if origin.startswith(self._stdlib) and not origin.startswith(self._site):
+            return False
+        try:
+            with open(origin, "rb") as file:
+                head = file.read(MARKER_SCAN_BYTES)
+        except OSError:
+            return False
+        return MARKER.search(head) is not None
+
+    def find_spec(self, fullname, path=None, target=None):
+        if not self.marker and not self._in_packages(fullname):
+            return None
+
+        spec = PathFinder.find_spec(fullname, path, target)
+        if spec is None or not isinstance(spec.loader, SourceFileLoader):
+            return None
+        if not self._in_packages(fullname) and not self._has_marker(spec.origin):
+            return None
+
+        spec.loader = PipeLoader(fullname, spec.origin)
+        return spec
+
+
+def install(*packages: str, marker: bool = True) -> PipeFinder:
+    """
+    Enables the pipe operator for modules imported from now on.
+    :param packages: Names of packages (or modules) whose modules are all transformed
+    :param marker: Whether modules containing the `# joffpype: pipes` marker comment are transformed
+    :returns: The installed finder
+    """
+    finder = PipeFinder(packages, marker)
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+def uninstall() -> None:
+    """Removes every finder installed by `install`"""
+    sys.meta_path[:] = [finder for finder in sys.meta_path if not isinstance(finder, PipeFinder)]
@@ -1,24 +1,40 @@
 """Extension: add a %_% and |_| pipe that can do everything but handling funcs() with parantheses while not requiring @ pipe function blocks"""
 
-from functools import partial
 from .superpipe import pipes
 
+# Inside @pipes code the transformer rewrites x |_| f and x %_% f into f(x),
+# these classes are only used by code that isn't transformed.
+
 @pipes
 class Infix(object):
+    __slots__ = ("func",)
     def __init__(self, func):
         self.func = func
     def __or__(self, other):
         return self.func(other)
     def __ror__(self, other):
-        return Infix(partial(self.func, other))
+        return _BoundInfix(self.func, other)
     def __mod__(self, other):
         return self.func(other)
     def __rmod__(self, other):
-        return Infix(partial(self.func, other))
+        return _BoundInfix(self.func, other)
     def __call__(self, v1, v2):
         return self.func(v1, v2)
 
 
+class _BoundInfix(Infix):
+    """`x |_` waiting for its right operand. Stores `x` directly instead of building a functools.partial."""
+    __slots__ = ("left",)
+    def __init__(self, func, left):
+        self.func = func
+        self.left = left
+    def __or__(self, other):
+        return self.func(self.left, other)
+    __mod__ = __or__
+    def __call__(self, *args):
+        return self.func(self.left, *args)
+
+
 @Infix
 @pipes
 def _(x, f):
@@ -0,0 +1,84 @@
+"""Lazy pipeline stages for streaming data through pipes
+
+The stages take the data first, so that they slot into the >> operator:
+
+    from joffpype import lazy
+
+    range(10**6) >> lazy.filter(lambda x: x % 3 == 0) >> lazy.map(lambda x: x * x) >> lazy.take(10) >> list
+
+Every stage returns an iterator and consumes its input one element at a time, so memory use stays constant.
+Inside @pipes code, consecutive map, filter and flat_map stages are fused into a single generator
+expression with their lambdas inlined. This relies on the module being imported under the name `lazy`.
+
+map and filter hand NumPy arrays and pandas objects to `joffpype.utils.vectorized` functions as a whole,
+and `batched` splits large arrays into slices for them:
+
+    arr >> lazy.batched(1_000_000) >> lazy.map(square) >> lazy.map(np.sum) >> sum
+"""
+
+import builtins
+from collections import deque
+from itertools import chain, islice
+from typing import Any, Callable, Iterable, Iterator, List, TypeVar
+
+from .utils import is_array
+
+T = TypeVar("T")
+S = TypeVar("S")
+
+
+def map(iterable: Iterable[T], f: Callable[[T], S]) -> Iterator[S]:
+    """
+    Applies `f` to each element of `iterable`.
+    If `iterable` is an array and `f` is `vectorized`, `f` is applied to the whole array and an array is returned.
+    """
+    if getattr(f, "vectorized", False) and is_array(iterable):
+        return f(iterable)
+    return builtins.map(f, iterable)
+
+
+def filter(iterable: Iterable[T], predicate: Callable[[T], Any]) -> Iterator[T]:
+    """
+    Keeps the elements of `iterable` for which `predicate` is truthy.
+    If `iterable` is a one-dimensional array and `predicate` is `vectorized`, the array is masked as a whole.
+    """
+    if getattr(predicate, "vectorized", False) and is_array(iterable) and iterable.ndim == 1:
+        return iterable[predicate(iterable)]
+    return builtins.filter(predicate, iterable)
+
+
+def flat_map(iterable: Iterable[T], f: Callable[[T], Iterable[S]]) -> Iterator[S]:
+    """Applies `f` to each element of `iterable` and yields the elements of the results"""
+    return chain.from_iterable(builtins.map(f, iterable))
+
+
+def take(iterable: Iterable[T], n: int) -> Iterator[T]:
+    """Yields the first `n` elements of `iterable`"""
+    return islice(iterable, n)
+
+
+def chunk(iterable: Iterable[T], n: int) -> Iterator[List[T]]:
+    """Groups the elements of `iterable` into lists of `n` elements. The last list may be shorter."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, n))
+        if not batch:
+            return
+        yield batch
+
+
+def batched(iterable: Iterable[T], n: int) -> Iterator[Iterable[T]]:
+    """
+    Hands `iterable` to the next stage in batches of `n` elements, so that vectorized stages run once per batch.
+    Arrays are split into slices, which are views rather than copies. Anything else is grouped like `chunk`.
+    """
+    if not is_array(iterable):
+        return chunk(iterable, n)
+    # pandas objects have to be sliced by position
+    rows = getattr(iterable, "iloc", iterable)
+    return (rows[start : start + n] for start in range(0, len(iterable), n))
+
+
+def foreach(iterable: Iterable[T], f: Callable[[T], Any]) -> None:
+    """Consumes `iterable`, applying `f` to each element"""
+    deque(builtins.map(f, iterable), maxlen=0)
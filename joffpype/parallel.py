@@ -0,0 +1,140 @@
+"""Parallel pipeline stages backed by shared thread and process pools
+
+The stages take the data first, so that they slot into the >> operator:
+
+    from joffpype.parallel import pmap
+
+    paths >> pmap(parse, workers=8, mode="process") >> list
+
+Work is sent to the pool in chunks to amortise the cost of inter-process communication, and only
+a bounded number of chunks is in flight at any time, so huge iterables are never materialised.
+In "process" mode `f` and the elements have to be picklable, i.e. no lambdas.
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+S = TypeVar("S")
+
+MODES: Tuple[str, ...] = ("thread", "process")
+
+# (mode, workers) -> executor, shared by all stages and created on first use
+_executors: Dict[Tuple[str, int], Executor] = {}
+_lock = threading.Lock()
+
+
+def _workers(workers: Optional[int]) -> int:
+    return workers or os.cpu_count() or 1
+
+
+def executor(mode: str = "thread", workers: Optional[int] = None) -> Executor:
+    """
+    Returns the shared executor for `mode` with `workers` workers, creating it on first use.
+    :param mode: "thread" or "process"
+    :param workers: Number of workers, defaults to the number of CPUs
+    """
+    if mode not in MODES:
+        raise ValueError(f"Expected mode to be one of {MODES}. Got: {mode!r}")
+    key = (mode, _workers(workers))
+    with _lock:
+        pool = _executors.get(key)
+        if pool is None:
+            factory = ThreadPoolExecutor if mode == "thread" else ProcessPoolExecutor
+            pool = _executors[key] = factory(max_workers=key[1])
+    return pool
+
+
+def shutdown(wait: bool = True) -> None:
+    """Shuts down every shared executor. New ones are created when a stage needs them again."""
+    with _lock:
+        pools = list(_executors.values())
+        _executors.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait)
+
+
+def _apply_chunk(f: Callable[[T], S], chunk: List[T]) -> List[S]:
+    return [f(item) for item in chunk]
+
+
+def _chunksize(iterable: Iterable, workers: int, mode: str) -> int:
+    # Threads share memory, so there is nothing to amortise
+    if mode == "thread":
+        return 1
+    # Like multiprocessing.Pool.map, aim for about four chunks per worker
+    try:
+        return max(1, len(iterable) // (workers * 4))
+    except TypeError:
+        return 64
+
+
+def _ordered(pool: Executor, f, chunks: Iterator[List], limit: int) -> Iterator:
+    pending = deque(pool.submit(_apply_chunk, f, chunk) for chunk in islice(chunks, limit))
+    try:
+        while pending:
+            results = pending.popleft().result()
+            # Keep the pool busy while the results are consumed
+            for chunk in islice(chunks, 1):
+                pending.append(pool.submit(_apply_chunk, f, chunk))
+            yield from results
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _unordered(pool: Executor, f, chunks: Iterator[List], limit: int) -> Iterator:
+    pending = {pool.submit(_apply_chunk, f, chunk) for chunk in islice(chunks, limit)}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for chunk in islice(chunks, len(done)):
+                pending.add(pool.submit(_apply_chunk, f, chunk))
+            for future in done:
+                yield from future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def pmap(
+    iterable: Iterable[T],
+    f: Callable[[T], S],
+    workers: Optional[int] = None,
+    mode: str = "thread",
+    chunksize: Optional[int] = None,
+    ordered: bool = True,
+    prefetch: int = 2,
+) -> Iterator[S]:
+    """
+    Lazily applies `f` to each element of `iterable` on a shared pool.
+    :param workers: Number of workers, defaults to the number of CPUs
+    :param mode: "thread" for I/O-bound work, "process" for CPU-bound work
+    :param chunksize: Number of elements sent to a worker at once, chosen automatically by default
+    :param ordered: Whether results are yielded in the order of `iterable`, or as soon as they are ready
+    :param prefetch: Number of chunks in flight per worker
+    """
+    # Either would submit nothing and silently yield no results
+    if chunksize is not None and chunksize < 1:
+        raise ValueError(f"Expected chunksize to be at least 1. Got: {chunksize!r}")
+    if prefetch < 1:
+        raise ValueError(f"Expected prefetch to be at least 1. Got: {prefetch!r}")
+    pool = executor(mode, workers)
+    workers = _workers(workers)
+    if chunksize is None:
+        chunksize = _chunksize(iterable, workers, mode)
+
+    iterator = iter(iterable)
+    chunks = iter(lambda: list(islice(iterator, chunksize)), [])
+    results = _ordered if ordered else _unordered
+    return results(pool, f, chunks, workers * prefetch)
+
+
+def pforeach(iterable: Iterable[T], f: Callable[[T], Any], **kwargs) -> None:
+    """Consumes `iterable`, applying `f` to each element on a shared pool. Takes the same options as `pmap`."""
+    kwargs.setdefault("ordered", False)
+    deque(pmap(iterable, f, **kwargs), maxlen=0)
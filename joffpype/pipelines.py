@@ -0,0 +1,136 @@
+"""Reusable pipelines, built once and applied to any number of values
+
+    from joffpype import memo, pipeline
+
+    p = pipeline(parse, validate, memo(enrich, maxsize=4096))
+    p(record)
+    p.map(records) >> list
+
+Inside @pipes code a pipeline can be written with the pipe operator, `__` standing for the input:
+
+    @pipes
+    def build():
+        return pipeline(__ >> parse >> validate(strict=True) >> enrich)
+
+The stages are composed into a single function when the pipeline is created, so applying it
+is as cheap as the equivalent nested calls. Pure stages can be memoised with `memo`.
+"""
+
+import threading
+import typing
+from ast import parse
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from time import monotonic
+
+from .superpipe import TEMP_PREFIX, _transform
+
+T = typing.TypeVar("T")
+S = typing.TypeVar("S")
+
+FACTORY_NAME: str = f"{TEMP_PREFIX}factory"
+
+# number of stages -> function taking the stages and returning them composed
+_factories: typing.Dict[int, typing.Callable[..., typing.Callable]] = {}
+
+
+def _identity(value):
+    return value
+
+
+def _factory(length: int) -> typing.Callable[..., typing.Callable]:
+    """
+    Returns a function that composes `length` stages into one flat function, `value >> s0 >> s1 >> ...`,
+    run through the pipe transformer. The stages are closure variables, so calling them needs no lookups.
+    Factories are compiled once per number of stages.
+    """
+    factory = _factories.get(length)
+    if factory is None:
+        names = [f"{TEMP_PREFIX}s{i}" for i in range(length)]
+        source = (
+            f"def {FACTORY_NAME}({', '.join(names)}):\n"
+            f"    def pipeline(value):\n"
+            f"        return value >> {' >> '.join(names)}\n"
+            f"    return pipeline\n"
+        )
+        namespace: dict = {}
+        exec(compile(_transform(parse(source)), "<pipeline>", "exec"), namespace)  # pylint: disable=exec-used
+        factory = _factories[length] = namespace[FACTORY_NAME]
+    return factory
+
+
+class Pipeline:
+    """A sequence of stages composed into a single function, callable on a single value"""
+
+    __slots__ = ("stages", "_func")
+
+    def __init__(self, *stages: typing.Callable):
+        flat = []
+        for stage in stages:
+            # Nested pipelines are flattened, so that they don't cost an extra call per stage
+            if isinstance(stage, Pipeline):
+                flat.extend(stage.stages)
+            elif callable(stage):
+                flat.append(stage)
+            else:
+                raise TypeError(f"Pipeline: Expected callable stages. Got: {type(stage)}")
+        self.stages: typing.Tuple[typing.Callable, ...] = tuple(flat)
+        self._func = _factory(len(flat))(*flat) if flat else _identity
+
+    def __call__(self, value):
+        return self._func(value)
+
+    def map(self, iterable: typing.Iterable) -> typing.Iterator:
+        """Lazily applies the pipeline to each element of `iterable`"""
+        return map(self._func, iterable)
+
+    def __reduce__(self):
+        # The composed function is a closure, rebuild it from the stages
+        return Pipeline, self.stages
+
+    def __repr__(self) -> str:
+        names = (getattr(stage, "__qualname__", repr(stage)) for stage in self.stages)
+        return f"Pipeline({', '.join(names)})"
+
+
+def pipeline(*stages: typing.Callable) -> Pipeline:
+    """
+    Composes `stages` into a `Pipeline`, applied from left to right.
+    Inside @pipes code, `pipeline(__ >> f >> g(x))` is rewritten into a pipeline of the single
+    stage `lambda v: g(f(v), x)`, so that the full pipe syntax is available.
+    """
+    return Pipeline(*stages)
+
+
+def memo(
+    func: typing.Callable[[T], S], maxsize: typing.Optional[int] = 128, ttl: typing.Optional[float] = None
+) -> typing.Callable[[T], S]:
+    """
+    Memoises the single-argument stage `func`, which has to be pure and take hashable values.
+    :param maxsize: Number of results kept, least recently used first out. None keeps every result
+    :param ttl: Seconds a result is kept, by default results don't expire
+    """
+    if ttl is None:
+        return lru_cache(maxsize=maxsize)(func)
+
+    results: "OrderedDict[typing.Any, typing.Tuple[float, S]]" = OrderedDict()
+    lock = threading.Lock()
+
+    @wraps(func)
+    def memoised(value: T) -> S:
+        now = monotonic()
+        with lock:
+            entry = results.get(value)
+            if entry is not None and entry[0] > now:
+                results.move_to_end(value)
+                return entry[1]
+        result = func(value)
+        with lock:
+            results[value] = (now + ttl, result)
+            results.move_to_end(value)
+            if maxsize is not None and len(results) > maxsize:
+                results.popitem(last=False)
+        return result
+
+    memoised.cache_clear = results.clear
+    return memoised
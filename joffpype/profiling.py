@@ -0,0 +1,163 @@
+"""Opt-in instrumentation of @pipes
+
+Two things can be measured:
+
+- decoration: the time spent in getsource, parse, transform, compile and exec for every decorated object
+- stages: calls and time of every rewritten >>, <<, |_| and %_% stage, keyed by file, line, column and source
+
+Enable it with the JOFFPYPE_PROFILE environment variable ("1" for decoration, "stages" for both),
+or by calling `enable` before the code in question is decorated or imported. Stage instrumentation
+is compiled into the generated code, with it disabled the generated code is exactly the same as without this module.
+
+    import joffpype
+    joffpype.profiling.enable(stages=True)
+    ...
+    joffpype.profiling.report()
+"""
+
+import os
+import sys
+import typing
+from time import perf_counter
+
+ENV: str = "JOFFPYPE_PROFILE"
+
+# Names under which instrumented code finds the hooks in its globals
+CLOCK_NAME: str = "_joffpype_clock"
+STAGE_NAME: str = "_joffpype_stage"
+
+_decoration_enabled: bool = bool(os.environ.get(ENV))
+_stages_enabled: bool = os.environ.get(ENV) == "stages"
+
+# "file:line name" -> {phase: seconds}
+_decorations: typing.Dict[str, typing.Dict[str, float]] = {}
+# "file:line:column stage" -> [calls, total seconds, seconds spent in the stages to the left]
+_stages: typing.Dict[str, typing.List[float]] = {}
+
+
+def enable(decoration: bool = True, stages: bool = False) -> None:
+    """Enables instrumentation for everything decorated or imported from now on"""
+    global _decoration_enabled, _stages_enabled
+    _decoration_enabled = decoration
+    _stages_enabled = stages
+
+
+def disable() -> None:
+    """Disables instrumentation for everything decorated or imported from now on"""
+    enable(False, False)
+
+
+def decoration_enabled() -> bool:
+    return _decoration_enabled
+
+
+def stages_enabled() -> bool:
+    return _stages_enabled
+
+
+class Phases:
+    """Records how long each phase of decorating one object takes"""
+
+    __slots__ = ("name", "times", "_last")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.times: typing.Dict[str, float] = {}
+        self._last = perf_counter()
+
+    def mark(self, phase: str) -> None:
+        """Attributes the time since the previous mark to `phase`"""
+        now = perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def done(self) -> None:
+        _decorations[self.name] = self.times
+
+
+class _NoPhases:
+    __slots__ = ()
+
+    def mark(self, phase: str) -> None:
+        pass
+
+    def done(self) -> None:
+        pass
+
+
+_NO_PHASES = _NoPhases()
+
+
+def phases(name: str) -> typing.Union[Phases, _NoPhases]:
+    """Returns a recorder for the decoration of `name`, which does nothing unless decoration profiling is enabled"""
+    return Phases(name) if _decoration_enabled else _NO_PHASES
+
+
+def stage(key: str, parent: typing.Optional[str], start: float, value):
+    """
+    Called by instrumented code as `stage(key, parent, clock(), <stage>)`, records the stage and returns `value`.
+    `parent` is the key of the stage this one is the left side of. Nesting is known when the code is generated,
+    so no stack has to be kept at runtime, which would go wrong with exceptions and interleaved coroutines.
+    """
+    elapsed = perf_counter() - start
+    entry = _stages.get(key)
+    if entry is None:
+        entry = _stages[key] = [0, 0.0, 0.0]
+    entry[0] += 1
+    entry[1] += elapsed
+    if parent is not None:
+        entry = _stages.get(parent)
+        if entry is None:
+            entry = _stages[parent] = [0, 0.0, 0.0]
+        entry[2] += elapsed
+    return value
+
+
+def install_hooks(namespace: dict) -> None:
+    """Makes the hooks available to instrumented code executed in `namespace`"""
+    namespace[CLOCK_NAME] = perf_counter
+    namespace[STAGE_NAME] = stage
+
+
+def stats() -> dict:
+    """
+    Returns the measurements so far:
+    {"decoration": {"file:line name": {phase: seconds}},
+     "stages": {"file:line:column stage": {"calls": n, "total": seconds, "own": seconds}}}
+    The total time of a stage includes the stages to its left, the own time does not.
+    """
+    return {
+        "decoration": {name: dict(times) for name, times in _decorations.items()},
+        "stages": {
+            key: {"calls": int(calls), "total": total, "own": total - nested}
+            for key, (calls, total, nested) in _stages.items()
+        },
+    }
+
+
+def reset() -> None:
+    """Discards all measurements"""
+    _decorations.clear()
+    _stages.clear()
+
+
+def report(file: typing.Optional[typing.TextIO] = None, limit: int = 20) -> None:
+    """Writes the `limit` slowest decorations and stages to `file` (stdout by default)"""
+    file = file or sys.stdout
+    data = stats()
+
+    decorations = sorted(data["decoration"].items(), key=lambda item: -sum(item[1].values()))
+    total = sum(sum(times.values()) for _, times in decorations)
+    print(f"Decoration: {len(decorations)} objects, {total * 1000:.3f} ms", file=file)
+    for name, times in decorations[:limit]:
+        breakdown = ", ".join(f"{phase} {seconds * 1000:.3f}" for phase, seconds in times.items())
+        print(f"  {sum(times.values()) * 1000:9.3f} ms  {name} ({breakdown})", file=file)
+
+    stages = sorted(data["stages"].items(), key=lambda item: -item[1]["own"])
+    print(f"Stages: {len(stages)}", file=file)
+    print(f"  {'calls':>10}  {'own ms':>10}  {'total ms':>10}  location", file=file)
+    for key, entry in stages[:limit]:
+        print(
+            f"  {entry['calls']:>10}  {entry['own'] * 1000:10.3f}  {entry['total'] * 1000:10.3f}  {key}",
+            file=file,
+        )
@@ -0,0 +1,113 @@
+"""Locates the source of decorated definitions with one parse per file.
+
+`inspect.getsource` scans the file through `linecache` and tokenizes it to find the end of every
+function, and parses the whole file again for every class. Instead, the first lookup in a file parses it
+once and records where each function and class starts and ends, later lookups just slice its lines.
+"""
+
+import os
+import tokenize
+import typing
+from ast import AST, AsyncFunctionDef, ClassDef, FunctionDef, Lambda, iter_child_nodes, parse
+
+
+class Definition(typing.NamedTuple):
+    qualname: str
+    # First line including decorators, and last line, both 1-based
+    first_line: int
+    end_line: int
+
+
+class _FileIndex:
+    """
+    The lines of a source file, the location of every definition in it by qualified name,
+    and the names of the coroutine functions it defines at module level
+    """
+
+    __slots__ = ("mtime_ns", "size", "lines", "definitions", "async_names")
+
+    def __init__(self, mtime_ns: int, size: int, lines: typing.List[str], tree: AST):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.lines = lines
+        self.definitions: typing.Dict[str, typing.List[Definition]] = {}
+        self._collect(tree, "")
+        self.async_names: typing.FrozenSet[str] = frozenset(
+            node.name for node in tree.body if isinstance(node, AsyncFunctionDef)
+        )
+
+    def _collect(self, node: AST, prefix: str) -> None:
+        for child in iter_child_nodes(node):
+            if isinstance(child, (AsyncFunctionDef, ClassDef, FunctionDef)):
+                qualname = prefix + child.name
+                first_line = min([child.lineno] + [dec.lineno for dec in child.decorator_list])
+                definition = Definition(qualname, first_line, child.end_lineno)
+                self.definitions.setdefault(qualname, []).append(definition)
+                # Mirrors how Python builds __qualname__
+                self._collect(child, qualname + ("." if isinstance(child, ClassDef) else ".<locals>."))
+            elif isinstance(child, Lambda):
+                self._collect(child, prefix + "<lambda>.<locals>.")
+            else:
+                self._collect(child, prefix)
+
+
+# path -> index, revalidated with the file's mtime and size
+_indexes: typing.Dict[str, _FileIndex] = {}
+
+
+def _index(path: str) -> typing.Optional[_FileIndex]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    index = _indexes.get(path)
+    if index is not None and index.mtime_ns == st.st_mtime_ns and index.size == st.st_size:
+        return index
+    try:
+        with tokenize.open(path) as file:
+            text = file.read()
+        tree = parse(text, filename=path)
+    except (OSError, SyntaxError, UnicodeDecodeError):
+        return None
+    index = _indexes[path] = _FileIndex(st.st_mtime_ns, st.st_size, text.splitlines(keepends=True), tree)
+    return index
+
+
+def definition_source(
+    path: typing.Optional[str], qualname: str, line: typing.Optional[int]
+) -> typing.Optional[typing.Tuple[str, int]]:
+    """
+    Returns the source of the definition `qualname` in the file `path` that spans `line`, or the only one
+    of that name if `line` is None, together with its first line. Returns None if there is no such definition,
+    e.g. for code without a source file.
+    """
+    if not path:
+        return None
+    index = _index(path)
+    if index is None:
+        return None
+    candidates = index.definitions.get(qualname, [])
+    if line is None:
+        # e.g. a class passed to pipes() from another file
+        if len(candidates) != 1:
+            return None
+        definition = candidates[0]
+    else:
+        for definition in candidates:
+            if definition.first_line <= line <= definition.end_line:
+                break
+        else:
+            return None
+    source = "".join(index.lines[definition.first_line - 1 : definition.end_line])
+    return source, definition.first_line
+
+
+def async_names(path: typing.Optional[str]) -> typing.FrozenSet[str]:
+    """Returns the names of the coroutine functions defined at the top level of the file `path`"""
+    index = _index(path) if path else None
+    return index.async_names if index is not None else frozenset()
+
+
+def clear() -> None:
+    """Discards every index, e.g. after source files were changed in place"""
+    _indexes.clear()
@@ -1,42 +1,113 @@
 """Implements an @pipes operator that transforms the >> operator to act similarly to Elixir pipes. change by joff: first instead of last argument"""
 
 
+import os
+import sys
 import typing
 from ast import (
     AST,
+    AsyncFunctionDef,
+    Await,
     Attribute,
     BinOp,
+    BitOr,
+    BoolOp,
     Call,
+    ClassDef,
+    Constant,
     Dict,
     DictComp,
+    ExceptHandler,
     FormattedValue,
+    FunctionDef,
     GeneratorExp,
+    Global,
+    IfExp,
+    Import,
+    ImportFrom,
+    Invert,
     JoinedStr,
     Lambda,
     List,
     ListComp,
+    Load,
     LShift,
+    Mod,
     Name,
+    NamedExpr,
     NodeTransformer,
+    Nonlocal,
     RShift,
     Set,
     SetComp,
     Starred,
+    Store,
     Subscript,
     Tuple,
+    UAdd,
+    UnaryOp,
+    USub,
+    Yield,
+    YieldFrom,
+    arg,
+    arguments,
+    boolop,
+    cmpop,
+    comprehension,
+    copy_location,
     dump,
+    expr_context,
+    fix_missing_locations,
     increment_lineno,
+    iter_child_nodes,
+    operator,
     parse,
+    unaryop,
+    unparse,
     walk,
 )
-from inspect import getsource, isclass, isfunction, stack
+from inspect import getsourcefile, getsourcelines, isclass, iscoroutinefunction, isfunction
 from itertools import takewhile
 from textwrap import dedent
+from types import CodeType
+
+from . import cache as _cache
+from . import profiling
+from . import sources as _sources
 
 SUB_IDENT: str = "__"
+INFIX_IDENT: str = "_"
+TEMP_PREFIX: str = "_joffpype_"
+LAZY_MODULE: str = "lazy"
+FUSABLE_STAGES: typing.Tuple[str, ...] = ("map", "filter", "flat_map")
+BUILTIN_STAGES: typing.Tuple[str, ...] = ("map", "filter")
+STAGE_SOURCE_LENGTH: int = 40
+PIPELINE_IDENT: str = "pipeline"
 
 
 class _PipeTransformer(NodeTransformer):
+    def __init__(
+        self, async_names: typing.AbstractSet[str] = frozenset(), stage_file: typing.Optional[str] = None
+    ):
+        super().__init__()
+        # Names of coroutine functions, calls to them are awaited in async functions
+        self.async_names = async_names
+        # If set, every stage is wrapped in the profiling hook and recorded under this file name
+        self.stage_file = stage_file
+        # Whether assignment expressions may be emitted at the current position. Only inside functions,
+        # a temporary in the module's globals would keep the left side alive for the life of the process
+        self._bind_ok = False
+        # Whether await may be emitted at the current position
+        self._in_async = False
+        # Whether the current position is directly in a class body, where names resolve differently than in a lambda
+        self._in_class = False
+        # Names bound by the enclosing functions that hide a coroutine function of the same name, e.g. parameters
+        self._shadowed: typing.FrozenSet[str] = frozenset()
+        # Number of times the left side was substituted by the current `handle_node`
+        self._substitutions = 0
+        # Number of generated temporary names so far
+        self._temps = 0
+
     def handle_atom(self, left: AST, atom: AST) -> typing.Tuple[AST, bool]:
         """
         Handle an "atom".
@@ -46,6 +117,7 @@ class _PipeTransformer(NodeTransformer):
         """
         if isinstance(atom, Name):
             if atom.id == SUB_IDENT:
+                self._substitutions += 1
                 return left, True
             else:
                 return atom, False
@@ -72,6 +144,7 @@ class _PipeTransformer(NodeTransformer):
         # So that it is substituted
         if isinstance(right, Name):
             if right.id == SUB_IDENT:
+                self._substitutions += 1
                 return left, True
 
         # _.attr or _[x]
@@ -85,6 +158,12 @@ class _PipeTransformer(NodeTransformer):
             if mod:
                 return right, True
 
+        # x >> await f
+        # The stage is marked as async, substitute into f and await the result
+        if isinstance(right, Await):
+            right.value, mod = self.handle_node(left, right.value, implicit, append)
+            return right, mod
+
         if isinstance(right, Lambda):
             right.expr, mod = self.handle_atom(left, right.body)
             # return right, mod
@@ -123,6 +202,7 @@ class _PipeTransformer(NodeTransformer):
             # Then we need to insert the left side
             # Into the arguments, if implicit is allowed
             if not modified and implicit:
+                self._substitutions += 1
                 if append:
                     right.args.append(left) ###### original but now for <<
                 else:
@@ -183,6 +263,7 @@ class _PipeTransformer(NodeTransformer):
             # If nothing else, we assume that we need to convert the right side into a function call
             # e.g. 5 >> print
             # This will break if the symbol is not callable, as is expected
+            self._substitutions += 1
             return (
                 Call(
                     func=right,
@@ -202,14 +283,496 @@ class _PipeTransformer(NodeTransformer):
         """
         Visitor method for BinOps. Returns the AST that takes the place of the input expression.
         """
+        if is_infix_pipe(node):
+            # x |_| f and x %_% f call f(x) through the Infix object at runtime, do it directly
+            key = self.stage_key(node.right)
+            left = self.visit(node.left.left)
+            ast = copy_location(Call(func=self.visit(node.right), args=[left], keywords=[]), node)
+            return self.instrument(key, left, ast)
+
+        key = self.stage_key(node.right)
         left, op, right = self.visit(node.left), node.op, node.right
+        self._substitutions = 0
         if isinstance(op, RShift): ##### original
             ast, _ = self.handle_node(left, right)
-            return ast
-        if isinstance(op, LShift): ##### added <<
+        elif isinstance(op, LShift): ##### added <<
             ast, _ = self.handle_node(left, right,append=True)
+        else:
+            return node
+        # Builtin map and filter calls are only fused where they are pipe stages
+        if isinstance(ast, Call):
+            ast._joffpype_stage = True
+        ast, force = self.inline_stage(left, ast)
+        return self.instrument(key, left, self.bind_left(left, self.await_stage(ast), force))
+
+    def inline_stage(self, left: AST, ast: AST) -> typing.Tuple[AST, bool]:
+        """
+        Inlines a lambda stage, `x >> (lambda v: v * 2)` becomes `x * 2` rather than a call,
+        and an identity stage like `x >> (lambda v: v)` disappears entirely.
+        `left` is substituted for every use of the parameter. Returns the new AST and whether
+        `bind_left` has to bind `left` even if it is used only once, because the lambda would have
+        evaluated it before anything in its body, or at all if the body doesn't use it.
+        """
+        if not (isinstance(ast, Call) and len(ast.args) == 1 and ast.args[0] is left and not ast.keywords):
+            return ast, False
+        param = inline_param(ast.func)
+        if param is None or self._in_class:
+            return ast, False
+
+        uses = sum(1 for node in walk(ast.func.body) if isinstance(node, Name) and node.id == param)
+        if isinstance(left, Name) or is_constant(left):
+            force = False
+        elif uses == 1 and evaluated_first(ast.func.body, param):
+            force = False
+        elif self._bind_ok:
+            force = True
+        else:
+            # Inlining would need an assignment expression, keep the call
+            return ast, False
+
+        self._substitutions += uses - 1
+        return _apply(ast.func, left), force
+
+    def stage_key(self, right: AST) -> typing.Optional[str]:
+        """Returns the key a stage is recorded under when profiling, e.g. `module.py:12:17 __ + 1`"""
+        if self.stage_file is None:
+            return None
+        source = unparse(right)
+        if len(source) > STAGE_SOURCE_LENGTH:
+            source = source[: STAGE_SOURCE_LENGTH - 3] + "..."
+        return f"{self.stage_file}:{right.lineno}:{right.col_offset} {source}"
+
+    def instrument(self, key: typing.Optional[str], left: AST, ast: AST) -> AST:
+        """
+        Wraps a rewritten stage in the profiling hook, `_joffpype_stage(key, None, _joffpype_clock(), ast)`.
+        If `left` is itself an instrumented stage, it is told that this stage is its parent.
+        Does nothing unless profiling was enabled when the transformer was created.
+        """
+        if key is None:
             return ast
+        if is_stage_hook(left):
+            left.args[1] = copy_location(Constant(value=key), left)
+        clock = copy_location(Call(func=Name(id=profiling.CLOCK_NAME, ctx=Load()), args=[], keywords=[]), ast)
+        hook = Call(
+            func=Name(id=profiling.STAGE_NAME, ctx=Load()),
+            args=[Constant(value=key), Constant(value=None), clock, ast],
+            keywords=[],
+        )
+        return copy_location(hook, ast)
+
+    def await_stage(self, ast: AST) -> AST:
+        """
+        Awaits `ast` if it is a call to one of `async_names` and we are inside an async function,
+        so that `url >> fetch >> parse` passes the result of `fetch` to `parse` rather than a coroutine.
+        Names that a parameter or assignment of an enclosing function rebinds are not awaited.
+        """
+        if self._in_async and isinstance(ast, Call) and isinstance(ast.func, Name):
+            if ast.func.id in self.async_names and ast.func.id not in self._shadowed:
+                return copy_location(Await(value=ast), ast)
+        return ast
+
+    def bind_left(self, left: AST, ast: AST, force: bool = False) -> AST:
+        """
+        Makes sure that the left side of a pipe is evaluated only once.
+        `handle_node` substitutes the very same `left` node for every `__`. If it did so
+        more than once, or `force` is set, the first use becomes an assignment expression to a
+        generated name, `(_joffpype_0 := left, ast)[1]`, and every use refers to that name instead.
+        Names and constants are cheap and side-effect free, so they are left alone.
+        """
+        if not self._bind_ok or isinstance(left, Name) or is_constant(left):
+            return ast
+        if self._substitutions < 2 and not force:
+            return ast
+
+        name = f"{TEMP_PREFIX}{self._temps}"
+        self._temps += 1
+        ast = _ReplaceNode(left, lambda: copy_location(Name(id=name, ctx=Load()), left)).visit(ast)
+
+        target = copy_location(Name(id=name, ctx=Store()), left)
+        bound = copy_location(NamedExpr(target=target, value=left), left)
+        pair = copy_location(Tuple(elts=[bound, ast], ctx=Load()), left)
+        index = copy_location(Constant(value=1), left)
+        return copy_location(Subscript(value=pair, slice=index, ctx=Load()), left)
+
+    def _visit_scope(
+        self,
+        node: AST,
+        bind_ok: bool,
+        in_async: bool,
+        in_class: bool = False,
+        inner: typing.Tuple[str, ...] = ("body",),
+        shadowed: typing.Optional[typing.FrozenSet[str]] = None,
+    ) -> AST:
+        """
+        Visits the `inner` fields of `node` with `bind_left`, `await_stage` and `inline_stage` enabled or disabled,
+        and with `shadowed` names, if given, in place of those of the enclosing scope.
+        The other fields, e.g. decorators and default values, are evaluated in the enclosing scope and visited as such.
+        """
+        scoped = {field: getattr(node, field) for field in inner}
+        for field in inner:
+            setattr(node, field, [])
+        self.generic_visit(node)
+
+        outer = self._bind_ok, self._in_async, self._in_class, self._shadowed
+        self._bind_ok, self._in_async, self._in_class = bind_ok, in_async, in_class
+        if shadowed is not None:
+            self._shadowed = shadowed
+        try:
+            for field, value in scoped.items():
+                if isinstance(value, list):
+                    value = [self.visit(item) for item in value]
+                    # Statements may be removed or expanded by a visitor, like in generic_visit
+                    value = [
+                        new for item in value if item is not None
+                        for new in (item if isinstance(item, list) else [item])
+                    ]
+                else:
+                    value = self.visit(value)
+                setattr(node, field, value)
+        finally:
+            self._bind_ok, self._in_async, self._in_class, self._shadowed = outer
+        return node
+
+    def _shadowed_in(self, node: AST) -> typing.FrozenSet[str]:
+        """Returns the names shadowed inside the function or lambda `node`"""
+        shadowing, unshadowing = local_bindings(node)
+        return (self._shadowed - unshadowing) | shadowing
+
+    def visit_FunctionDef(self, node: FunctionDef) -> AST:
+        return self._visit_scope(node, True, False, shadowed=self._shadowed_in(node))
+
+    visit_Lambda = visit_FunctionDef
+
+    def visit_AsyncFunctionDef(self, node: AsyncFunctionDef) -> AST:
+        return self._visit_scope(node, True, True, shadowed=self._shadowed_in(node))
+
+    def visit_ClassDef(self, node: ClassDef) -> AST:
+        # An assignment expression in a class body would leak the temporary into the class namespace,
+        # and they are not allowed at all in comprehensions inside a class body
+        return self._visit_scope(node, False, False, True)
+
+    def visit_GeneratorExp(self, node: GeneratorExp) -> AST:
+        # An await would turn the generator into an async generator. In the other comprehensions it would
+        # run the calls one after another, where `[u >> fetch for u in urls] >> gather(*__)` runs them concurrently
+        return self._visit_scope(node, self._bind_ok, False, self._in_class, tuple(node._fields))
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp
+
+    def visit_comprehension(self, node: comprehension) -> AST:
+        # Assignment expressions are not allowed in comprehension iterables
+        outer, self._bind_ok = self._bind_ok, False
+        try:
+            node.iter = self.visit(node.iter)
+        finally:
+            self._bind_ok = outer
+        node.ifs = [self.visit(test) for test in node.ifs]
+        return node
+
+    def visit_Call(self, node: Call) -> AST:
+        # pipeline(__ >> f >> g) becomes pipeline(lambda v: g(f(v)))
+        if isinstance(node.func, Name) and node.func.id == PIPELINE_IDENT and len(node.args) == 1:
+            head = pipeline_head(node.args[0])
+            if head is not None:
+                param = f"{TEMP_PREFIX}v{self._temps}"
+                self._temps += 1
+                head.id = param
+                params = arguments(
+                    posonlyargs=[], args=[arg(arg=param)], vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]
+                )
+                node.args[0] = copy_location(Lambda(args=params, body=node.args[0]), node.args[0])
+        return self.generic_visit(node)
+
+
+class _ReplaceNode(NodeTransformer):
+    """Replaces every occurrence of the node `target` (by identity) with a node created by `factory`"""
+
+    def __init__(self, target: AST, factory: typing.Callable[[], AST]):
+        self.target = target
+        self.factory = factory
+
+    def visit(self, node: AST) -> AST:
+        if node is self.target:
+            return self.factory()
+        return super().visit(node)
+
+
+class _ReplaceName(NodeTransformer):
+    """Replaces every occurrence of the name `name` with the node `value`"""
+
+    def __init__(self, name: str, value: AST):
+        self.name = name
+        self.value = value
+
+    def visit_Name(self, node: Name) -> AST:
+        return self.value if node.id == self.name else node
+
+
+class _FuseTransformer(NodeTransformer):
+    """
+    Fuses consecutive joffpype.lazy map/filter/flat_map stages, and builtin map/filter calls, into a single
+    generator expression, so that every element passes through one generator instead of one iterator per stage.
+    Lambdas are inlined into the generator expression. A run of stages starts at the first stage
+    that calls a lambda: stages calling named functions before that are left to the builtins,
+    which are implemented in C and also know how to handle arrays.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Number of generated loop variables so far
+        self._vars = 0
+
+    def _new_var(self) -> str:
+        name = f"{TEMP_PREFIX}it{self._vars}"
+        self._vars += 1
+        return name
+
+    def _element(self, gen: GeneratorExp) -> str:
+        """Returns the name of the current element of `gen`, binding it with `for v in (elt,)` if necessary"""
+        if isinstance(gen.elt, Name):
+            return gen.elt.id
+        var = self._new_var()
+        # CPython compiles a single-element `for` clause to a plain assignment
+        gen.generators.append(
+            comprehension(
+                target=Name(id=var, ctx=Store()),
+                iter=Tuple(elts=[gen.elt], ctx=Load()),
+                ifs=[],
+                is_async=0,
+            )
+        )
+        gen.elt = Name(id=var, ctx=Load())
+        return var
+
+    def visit_Call(self, node: Call) -> AST:
+        node = self.generic_visit(node)
+        stage = fusable_stage(node)
+        if stage is None:
+            return node
+
+        stage, source, func = stage
+        fused = getattr(source, "_joffpype_fused", False)
+        if inline_param(func) is None and not (fused and is_dotted_name(func)):
+            return node
+        # The source becomes the first iterable of a generator expression, where assignment expressions
+        # aren't allowed, e.g. when bind_left bound a left side that was substituted more than once
+        if not fused and any(isinstance(child, NamedExpr) for child in walk(source)):
+            return node
+
+        if fused:
+            gen = source
+        else:
+            var = self._new_var()
+            gen = GeneratorExp(
+                elt=Name(id=var, ctx=Load()),
+                generators=[
+                    comprehension(target=Name(id=var, ctx=Store()), iter=source, ifs=[], is_async=0)
+                ],
+            )
+            gen._joffpype_fused = True
+
+        value = Name(id=self._element(gen), ctx=Load())
+        if stage == "map":
+            gen.elt = _apply(func, value)
+        elif stage == "filter":
+            gen.generators[-1].ifs.append(_apply(func, value))
+        else:
+            var = self._new_var()
+            gen.generators.append(
+                comprehension(target=Name(id=var, ctx=Store()), iter=_apply(func, value), ifs=[], is_async=0)
+            )
+            gen.elt = Name(id=var, ctx=Load())
+        return copy_location(gen, node)
+
+
+def _apply(func: AST, value: AST) -> AST:
+    """
+    Returns an expression applying `func` to `value`, inlining `func` if it is a lambda.
+    When inlining, every use of the parameter is replaced by the very same `value` node.
+    """
+    param = inline_param(func)
+    if param is None:
+        return Call(func=func, args=[value], keywords=[])
+    return _ReplaceName(param, value).visit(func.body)
+
+
+def inline_param(func: AST) -> typing.Optional[str]:
+    """
+    Returns the parameter name if `func` is a lambda of one positional parameter that can be inlined
+    by renaming that parameter, otherwise None.
+    Lambdas containing nested scopes or assignment expressions are never inlined.
+    """
+    if not isinstance(func, Lambda):
+        return None
+    args = func.args
+    if args.posonlyargs or args.vararg or args.kwonlyargs or args.kwarg or args.defaults:
+        return None
+    if len(args.args) != 1:
+        return None
+    scoped = (Await, DictComp, GeneratorExp, Lambda, ListComp, NamedExpr, SetComp, Yield, YieldFrom)
+    if any(isinstance(node, scoped) for node in walk(func.body)):
+        return None
+    return args.args[0].arg
+
+
+def local_bindings(scope: AST) -> typing.Tuple[typing.FrozenSet[str], typing.FrozenSet[str]]:
+    """
+    Returns the names bound by the function or lambda `scope` itself, not by the scopes nested in it, in two sets:
+    the names it binds other than with `async def`, e.g. parameters and assignments, and the names it binds only
+    with `async def` or declares `global`, which refer to coroutine functions or the module again.
+    """
+    args = scope.args
+    params = args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]
+    bound = {param.arg for param in params if param is not None}
+    async_bound, declared_global, declared_nonlocal = set(), set(), set()
+
+    todo = list(scope.body) if isinstance(scope.body, list) else [scope.body]
+    while todo:
+        node = todo.pop()
+        if isinstance(node, AsyncFunctionDef):
+            async_bound.add(node.name)
+            continue
+        if isinstance(node, (ClassDef, FunctionDef)):
+            bound.add(node.name)
+            continue
+        if isinstance(node, Lambda):
+            continue
+        if isinstance(node, (DictComp, GeneratorExp, ListComp, SetComp)):
+            # Their targets are local to the comprehension, only an assignment expression binds outside of it
+            todo.extend(target for target in walk(node) if isinstance(target, NamedExpr))
+            continue
+        if isinstance(node, Name) and isinstance(node.ctx, Store):
+            bound.add(node.id)
+        elif isinstance(node, (Import, ImportFrom)):
+            bound.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+        elif isinstance(node, Global):
+            declared_global.update(node.names)
+        elif isinstance(node, Nonlocal):
+            declared_nonlocal.update(node.names)
+        elif isinstance(node, ExceptHandler) or type(node).__name__ in ("MatchAs", "MatchStar"):
+            bound.add(node.name)
+        elif type(node).__name__ == "MatchMapping":
+            bound.add(node.rest)
+        todo.extend(iter_child_nodes(node))
+
+    declared = declared_global | declared_nonlocal
+    bound.discard(None)
+    return frozenset(bound - declared), frozenset((async_bound - bound - declared) | declared_global)
+
+
+def evaluated_first(expr: AST, name: str) -> bool:
+    """
+    Determines if the name `name` is unconditionally the first thing evaluated in `expr`,
+    so that substituting an expression for it keeps the order of evaluation. Only constants may come before it,
+    another name could be rebound by the substituted expression, e.g. `bump() >> (lambda v: counter + v)`.
+    """
+    for node in _evaluation_order(expr):
+        if isinstance(node, Name):
+            return node.id == name
+        if not isinstance(node, (Constant, expr_context, operator, unaryop, cmpop, boolop)):
+            return False
+    return False
+
+
+def _evaluation_order(node: AST) -> typing.Iterator[AST]:
+    """
+    Yields the nodes of `node` in roughly the order they are evaluated, children before their parent.
+    Only the unconditionally evaluated part of a conditional is descended into, and dictionaries not at all.
+    """
+    if isinstance(node, IfExp):
+        children = [node.test]
+    elif isinstance(node, BoolOp):
+        children = node.values[:1]
+    elif isinstance(node, Dict):
+        children = []
+    else:
+        children = iter_child_nodes(node)
+    for child in children:
+        yield from _evaluation_order(child)
+    yield node
+
+
+def is_constant(node: AST) -> bool:
+    """
+    Determines if `node` is a literal that CPython folds into a single constant, e.g. `5`, `-1` or `(1, "a")`.
+    Such nodes can be repeated instead of bound to a name, and are folded once they are substituted.
+    """
+    if isinstance(node, UnaryOp) and isinstance(node.op, (UAdd, USub, Invert)):
+        node = node.operand
+    if isinstance(node, Tuple):
+        return all(is_constant(elt) for elt in node.elts)
+    return isinstance(node, Constant)
+
+
+def is_dotted_name(node: AST) -> bool:
+    """Determines if `node` is a name or a chain of attributes on a name, e.g. `str.strip`"""
+    while isinstance(node, Attribute):
+        node = node.value
+    return isinstance(node, Name)
+
+
+def lazy_stage(node: AST) -> typing.Optional[str]:
+    """
+    Returns the name of the joffpype.lazy stage that `node` calls, or None.
+    Like `is_pipes_decorator` this relies on naming: stages are recognized as attributes of `lazy`.
+    :param node: An AST node to check
+    """
+    if isinstance(node, Call) and isinstance(node.func, Attribute):
+        if isinstance(node.func.value, Name) and node.func.value.id == LAZY_MODULE:
+            return node.func.attr
+    return None
+
+
+def fusable_stage(node: AST) -> typing.Optional[typing.Tuple[str, AST, AST]]:
+    """
+    Returns (stage, iterable, function) if `node` is a stage `_FuseTransformer` can fuse, otherwise None.
+    Both the data-first joffpype.lazy stages, `lazy.map(iterable, f)`, and the builtins, `map(f, iterable)`, qualify.
+    Like `lazy_stage` this relies on naming: the builtins are recognized as calls to `map` and `filter`,
+    and only if they are pipe stages, `xs >> map(f, __)`, other calls keep returning map and filter objects.
+    """
+    if not isinstance(node, Call) or len(node.args) != 2 or node.keywords:
+        return None
+    if any(isinstance(arg, Starred) for arg in node.args):
+        return None
+    stage = lazy_stage(node)
+    if stage in FUSABLE_STAGES:
+        return stage, node.args[0], node.args[1]
+    if isinstance(node.func, Name) and node.func.id in BUILTIN_STAGES and getattr(node, "_joffpype_stage", False):
+        return node.func.id, node.args[1], node.args[0]
+    return None
+
+
+def pipeline_head(node: AST) -> typing.Optional[Name]:
+    """
+    Returns the `__` that a chain of pipes like `__ >> f >> g` starts with, or None if it doesn't start with one.
+    Like `SUB_IDENT` itself, the placeholder is recognized purely by its name.
+    """
+    while isinstance(node, BinOp) and isinstance(node.op, (RShift, LShift)):
+        node = node.left
+    if isinstance(node, Name) and node.id == SUB_IDENT:
         return node
+    return None
+
+
+def is_stage_hook(node: AST) -> bool:
+    """Determines if `node` is a stage wrapped in the profiling hook by `_PipeTransformer.instrument`"""
+    return isinstance(node, Call) and isinstance(node.func, Name) and node.func.id == profiling.STAGE_NAME
+
+
+def is_infix_pipe(node: BinOp) -> bool:
+    """
+    Determines if `node` is an application of the Infix pipe, `x |_| f` or `x %_% f`.
+    Like `SUB_IDENT`, the sentinel is recognized purely by its name.
+    :param node: A BinOp to check
+    """
+    if not isinstance(node.op, (BitOr, Mod)):
+        return False
+    inner = node.left
+    return (
+        isinstance(inner, BinOp)
+        and type(inner.op) is type(node.op)
+        and isinstance(inner.right, Name)
+        and inner.right.id == INFIX_IDENT
+    )
 
 
 def is_pipes_decorator(dec: AST) -> bool:
@@ -229,52 +792,185 @@ def is_pipes_decorator(dec: AST) -> bool:
     return False
 
 
-# pylint: disable=exec-used
-def pipes(func_or_class):
+def _has_async(func_or_class) -> bool:
+    """Determines if `func_or_class` is or has coroutine functions, where stages may be awaited"""
+    if isclass(func_or_class):
+        return any(iscoroutinefunction(value) for value in vars(func_or_class).values())
+    return iscoroutinefunction(func_or_class)
+
+
+def _async_names(func_or_class, ctx: dict) -> typing.FrozenSet[str]:
     """
-    Enables the pipe operator in the decorated function, method, or class
+    Returns the names in `ctx` that are bound to coroutine functions,
+    if `func_or_class` has any async code that could call them.
     """
-    if isclass(func_or_class):
-        decorator_frame = stack()[1]
-        ctx = decorator_frame[0].f_locals
-        first_line_number = decorator_frame[2]
-    elif isfunction(func_or_class):
-        ctx = func_or_class.__globals__
-        first_line_number = func_or_class.__code__.co_firstlineno
-    else:
-        raise ValueError(f"@pipes: Expected function or class. Got: {type(func_or_class)}")
+    if not _has_async(func_or_class):
+        return frozenset()
+    return frozenset(name for name, value in list(ctx.items()) if iscoroutinefunction(value))
 
-    source = getsource(func_or_class)
+
+def _transform(
+    tree: AST,
+    async_names: typing.AbstractSet[str] = frozenset(),
+    stage_file: typing.Optional[str] = None,
+) -> AST:
+    """
+    Applies the pipe operator to a whole parsed module, e.g. a single decorated definition.
+    :param async_names: Names of coroutine functions defined outside of `tree`
+    :param stage_file: If set, stages are instrumented for profiling and recorded under this file name
+    """
+    # Single pass over the tree to collect what the transformers need
+    async_defs = []
+    methods = set()
+    fusable = False
+    for node in walk(tree):
+        if isinstance(node, (AsyncFunctionDef, ClassDef, FunctionDef)):
+            # remove the pipe decorators so that we don't recursively
+            # call them again. The AST node for the decorator will be a
+            # Call if it had braces, and a Name if it had no braces.
+            # The location of the decorator function name in these
+            # nodes is slightly different.
+            node.decorator_list = [
+                dec for dec in node.decorator_list if not is_pipes_decorator(dec)
+            ]
+        if isinstance(node, ClassDef):
+            methods.update(id(stmt) for stmt in node.body)
+        elif isinstance(node, AsyncFunctionDef):
+            async_defs.append(node)
+        elif isinstance(node, Name) and (node.id == LAZY_MODULE or node.id in BUILTIN_STAGES):
+            fusable = True
+
+    # Coroutine functions defined in the tree can be called by name, unless they are methods
+    async_names = async_names | {node.name for node in async_defs if id(node) not in methods}
+
+    # Apply the visit_BinOp transformation
+    tree = _PipeTransformer(async_names, stage_file).visit(tree)
+
+    # Fuse lazy stages and builtin map/filter calls into generator expressions
+    if fusable:
+        tree = _FuseTransformer().visit(tree)
+
+    return fix_missing_locations(tree)
+
+
+def _compile(
+    func_or_class,
+    filename: str,
+    source_file: typing.Optional[str],
+    first_line_number: typing.Optional[int],
+    async_names: typing.AbstractSet[str],
+    phases: profiling.Phases,
+) -> CodeType:
+    """
+    Compiles the definition of `func_or_class` with the pipe operator enabled.
+    Returns a code object that, when executed, defines the transformed function or class.
+    :param first_line_number: A line of the definition in `source_file`, if known
+    """
+    # Every definition in a file is located with a single parse of that file,
+    # getsource is only needed for code the index doesn't know, e.g. from a REPL
+    located = _sources.definition_source(source_file, func_or_class.__qualname__, first_line_number)
+    if located is None:
+        lines, first_line_number = getsourcelines(func_or_class)
+        source = "".join(lines)
+    else:
+        source, first_line_number = located
+    phases.mark("getsource")
 
     # AST data structure representing parsed function code
     tree = parse(dedent(source))
 
     # Fix line and column numbers so that debuggers still work
     increment_lineno(tree, first_line_number - 1)
-    source_indent = sum([1 for _ in takewhile(str.isspace, source)]) + 1
+    source_indent = sum([1 for _ in takewhile(str.isspace, source)])
 
-    for node in walk(tree):
-        if hasattr(node, "col_offset"):
-            node.col_offset += source_indent
-
-    # remove the pipe decorator so that we don't recursively
-    # call it again. The AST node for the decorator will be a
-    # Call if it had braces, and a Name if it had no braces.
-    # The location of the decorator function name in these
-    # nodes is slightly different.
-    tree.body[0].decorator_list = [
-        dec for dec in tree.body[0].decorator_list if not is_pipes_decorator(dec)
-    ]
+    # dedent removed the indentation from every line, so both ends of a node move by the same amount
+    if source_indent:
+        for node in walk(tree):
+            if hasattr(node, "col_offset"):
+                node.col_offset += source_indent
+                if getattr(node, "end_col_offset", None) is not None:
+                    node.end_col_offset += source_indent
 
-    # Apply the visit_BinOp transformation
-    tree = _PipeTransformer().visit(tree)
+    phases.mark("parse")
+
+    # Coroutine functions defined further down in the module aren't bound yet when the decorator runs
+    if _has_async(func_or_class):
+        async_names = async_names | _sources.async_names(source_file)
+
+    stage_file = filename if profiling.stages_enabled() else None
+    tree = _transform(tree, async_names, stage_file)
+    phases.mark("transform")
 
     # now compile the AST into an altered function or class definition
-    code = compile(tree, filename=(ctx["__file__"] if "__file__" in ctx else "repl"), mode="exec")
+    code = compile(tree, filename=filename, mode="exec")
+    phases.mark("compile")
+    return code
+
+
+def _source_file(cls) -> typing.Optional[str]:
+    """Returns the file `cls` was defined in, or None if it has no source file"""
+    try:
+        return getsourcefile(cls)
+    except TypeError:
+        return None
+
+
+def _same_file(a: str, b: str) -> bool:
+    return os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b))
+
+
+# pylint: disable=exec-used
+def pipes(func_or_class):
+    """
+    Enables the pipe operator in the decorated function, method, or class
+    """
+    if isclass(func_or_class):
+        # Only the calling frame is needed, inspect.stack() would build every frame with its source context
+        decorator_frame = sys._getframe(1)  # pylint: disable=protected-access
+        ctx = decorator_frame.f_locals
+        source_file = _source_file(func_or_class)
+        # The caller's line is only a line of the class if it is decorated where it is defined,
+        # rather than passed to pipes() from somewhere else
+        first_line_number = decorator_frame.f_lineno
+        if source_file is None or not _same_file(decorator_frame.f_code.co_filename, source_file):
+            first_line_number = None
+    elif isfunction(func_or_class):
+        ctx = func_or_class.__globals__
+        first_line_number = func_or_class.__code__.co_firstlineno
+        source_file = func_or_class.__code__.co_filename
+    else:
+        raise ValueError(f"@pipes: Expected function or class. Got: {type(func_or_class)}")
+
+    filename = ctx["__file__"] if "__file__" in ctx else "repl"
+    phases = profiling.phases(f"{filename}:{first_line_number} {func_or_class.__qualname__}")
+    async_names = _async_names(func_or_class, ctx)
+
+    # Look for code generated by an earlier run before touching the source,
+    # the key changes whenever the file containing the definition does
+    key = _cache.make_key(
+        _cache.file_digest(source_file),
+        filename,
+        first_line_number,
+        func_or_class.__qualname__,
+        sorted(async_names),
+        profiling.stages_enabled(),
+    )
+    code = _cache.load(key) if key is not None else None
+    phases.mark("cache")
+    if code is None:
+        code = _compile(func_or_class, filename, source_file, first_line_number, async_names, phases)
+        if key is not None:
+            _cache.store(key, code)
+            phases.mark("cache")
+
+    if profiling.stages_enabled():
+        profiling.install_hooks(ctx)
 
     # and execute the definition in the original context so that the
     # decorated function can access the same scopes as the original
     exec(code, ctx)
+    phases.mark("exec")
+    phases.done()
 
     # return the modified function or class - original is never called
-    return ctx[tree.body[0].name]
+    return ctx[func_or_class.__name__]
@@ -1,11 +1,54 @@
-"""Various utilities for functional programming and piping"""
+"""Various utilities for functional programming and piping
+
+The predicates and operations marked as `vectorized` also accept NumPy arrays and pandas objects,
+which they process as a whole with ufuncs instead of element by element. NumPy is optional.
+"""
 
 from typing import Any, Callable, Iterable, TypeVar, Union
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 T = TypeVar("T")
 S = TypeVar("S")
 
 
+def is_array(item) -> bool:
+    """Determines if `item` supports NumPy ufuncs, e.g. an ndarray or a pandas Series or DataFrame"""
+    return np is not None and hasattr(type(item), "__array_ufunc__")
+
+
+def vectorized(f: Callable[[T], S]) -> Callable[[T], S]:
+    """
+    Marks `f` as applicable to a whole array at once, with the same result as applying it to every element.
+    Stages like `joffpype.lazy.map` then call `f` once with the array instead of once per element.
+    """
+    f.vectorized = True
+    return f
+
+
+def _is_pandas(item) -> bool:
+    return hasattr(item, "isna")
+
+
+def _kinds(item) -> set:
+    """The NumPy dtype kinds of the array `item`, one per column for a DataFrame"""
+    if hasattr(item, "dtype"):
+        return {item.dtype.kind}
+    return {dtype.kind for dtype in item.dtypes}
+
+
+def _elementwise(item, predicate: Callable[[Any], bool]):
+    """Applies `predicate` to every element of the array `item`, returning an array of the same type and shape"""
+    if _is_pandas(item):
+        # DataFrame.map was called applymap before pandas 2.1
+        mapper = item.map if hasattr(item, "map") else item.applymap
+        return mapper(predicate)
+    return np.frompyfunc(predicate, 1, 1)(item).astype(bool)
+
+
 def foreach(f: Callable[[T], S], iter: Iterable[T]) -> None:
     """Consumes an iterable. Applies `f` to each element of `iter` and returns nothing"""
     for item in iter:
@@ -15,18 +58,29 @@ def foreach(f: Callable[[T], S], iter: Iterable[T]) -> None:
 # Predicates
 
 
+@vectorized
 def is_none(item) -> bool:
+    if is_array(item):
+        # Only object arrays can hold None. isna would also count NaN, np.equal would call __eq__
+        if not _is_pandas(item) and "O" not in _kinds(item):
+            return np.zeros(np.shape(item), dtype=bool)
+        return _elementwise(item, lambda value: value is None)
     return item is None
 
 
+@vectorized
 def is_not_none(item) -> bool:
+    if is_array(item):
+        return ~is_none(item)
     return item is not None
 
 
+@vectorized
 def is_even(n) -> bool:
     return n % 2 == 0
 
 
+@vectorized
 def is_odd(n) -> bool:
     return n % 2 != 0
 
@@ -34,16 +88,24 @@ def is_odd(n) -> bool:
 is_truthy = bool
 
 
+@vectorized
 def is_falsy(item) -> bool:
+    if is_array(item):
+        # Strings, objects etc. have no logical_not, and their truth value is Python's to decide
+        if _kinds(item) <= set("biufc"):
+            return np.logical_not(item)
+        return _elementwise(item, lambda value: not value)
     return not item
 
 
 # Operations
 
 
+@vectorized
 def square(x):
     return x * x
 
 
+@vectorized
 def cube(x):
     return x * x * x
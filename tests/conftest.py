@@ -0,0 +1,4 @@
+import os
+
+# Tests always transform from scratch instead of reading the on-disk cache
+os.environ["JOFFPYPE_NO_CACHE"] = "1"
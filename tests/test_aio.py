@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from joffpype.aio import amap
+
+
+async def double(x):
+    await asyncio.sleep(0.01 if x % 2 else 0)
+    return x * 2
+
+
+def test_results_keep_the_order_of_the_input():
+    assert asyncio.run(amap(range(10), double, concurrency=3)) == [x * 2 for x in range(10)]
+
+
+def test_regular_functions_and_async_iterables():
+    async def numbers():
+        for x in range(5):
+            yield x
+
+    assert asyncio.run(amap(numbers(), str)) == ["0", "1", "2", "3", "4"]
+    assert asyncio.run(amap([], double)) == []
+
+
+def test_concurrency_is_bounded():
+    running = []
+    peak = []
+
+    async def track(x):
+        running.append(x)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(x)
+        return x
+
+    assert asyncio.run(amap(range(10), track, concurrency=3)) == list(range(10))
+    assert max(peak) == 3
+
+
+def test_a_failure_cancels_the_other_calls():
+    finished = []
+
+    async def fail_on_one(x):
+        if x == 1:
+            raise ValueError(x)
+        await asyncio.sleep(0.1)
+        finished.append(x)
+
+    with pytest.raises(ValueError):
+        asyncio.run(amap(range(4), fail_on_one, concurrency=4))
+    assert finished == []
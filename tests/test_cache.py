@@ -0,0 +1,130 @@
+import importlib
+import marshal
+import os
+import subprocess
+import sys
+from textwrap import dedent
+
+import pytest
+
+from joffpype import cache, superpipe
+
+MODULE = """
+from joffpype import pipes
+
+@pipes
+def f(x):
+    assert x > 0
+    return x >> __ + {}
+"""
+
+
+def write(path, source: str) -> None:
+    path.write_text(dedent(source))
+    # Make sure the change is visible even on file systems with coarse timestamps
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Enables the cache in its own directory"""
+    directory = tmp_path / "cache"
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delenv(cache.ENV_DISABLE, raising=False)
+    monkeypatch.setenv(cache.ENV_DIR, str(directory))
+    monkeypatch.setattr(sys, "dont_write_bytecode", False)
+    monkeypatch.setattr(cache, "_cache_size", None)
+    yield directory
+    sys.modules.pop("cached", None)
+
+
+@pytest.fixture
+def compiled(monkeypatch):
+    """The qualified names of the objects whose code was generated rather than loaded"""
+    names = []
+    original = superpipe._compile
+
+    def counting(func_or_class, *args):
+        names.append(func_or_class.__qualname__)
+        return original(func_or_class, *args)
+
+    monkeypatch.setattr(superpipe, "_compile", counting)
+    return names
+
+
+def load(name: str = "cached"):
+    sys.modules.pop(name, None)
+    importlib.invalidate_caches()
+    return importlib.import_module(name)
+
+
+def entries(directory) -> list:
+    return sorted(directory.glob("*" + cache.SUFFIX)) if directory.exists() else []
+
+
+def test_warm_start_skips_compilation(tmp_path, cache_dir, compiled):
+    write(tmp_path / "cached.py", MODULE.format(1))
+    assert load().f(1) == 2
+    assert compiled == ["f"] and len(entries(cache_dir)) == 1
+
+    assert load().f(1) == 2
+    assert compiled == ["f"]
+
+
+def test_editing_the_file_invalidates_its_entries(tmp_path, cache_dir, compiled):
+    write(tmp_path / "cached.py", MODULE.format(1))
+    assert load().f(1) == 2
+    write(tmp_path / "cached.py", MODULE.format(100))
+    assert load().f(1) == 101
+    assert compiled == ["f", "f"]
+
+
+def test_disabled_cache_is_not_used(tmp_path, cache_dir, compiled, monkeypatch):
+    monkeypatch.setenv(cache.ENV_DISABLE, "1")
+    write(tmp_path / "cached.py", MODULE.format(1))
+    load()
+    load()
+    assert compiled == ["f", "f"]
+    assert entries(cache_dir) == []
+
+
+def test_nothing_is_written_without_bytecode(tmp_path, cache_dir, compiled, monkeypatch):
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    write(tmp_path / "cached.py", MODULE.format(1))
+    load()
+    assert entries(cache_dir) == []
+
+
+def test_least_recently_used_entries_are_evicted(cache_dir, monkeypatch):
+    code = compile("x = 1", "<test>", "exec")
+    size = len(marshal.dumps(code))
+    monkeypatch.setenv(cache.ENV_MAX_SIZE, str(size * 4))
+    keys = [cache.make_key(cache.source_digest(b"x = 1"), i) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.store(key, code)
+        os.utime(cache._entry_path(key), (i, i))
+    # Reading an entry makes it the most recently used one
+    assert cache.load(keys[0]) == code
+
+    cache.store(cache.make_key(cache.source_digest(b"x = 1"), 4), code)
+    assert len(entries(cache_dir)) == 3
+    assert cache.load(keys[0]) == code
+    assert cache.load(keys[1]) is None and cache.load(keys[2]) is None
+
+
+def test_optimization_level_is_part_of_the_key(tmp_path, cache_dir):
+    digest = cache.source_digest(b"x = 1")
+    assert cache.make_key(digest, 1, optimize=1) != cache.make_key(digest, 1, optimize=0)
+    assert cache.make_key(digest, 1) == cache.make_key(digest, 1, optimize=sys.flags.optimize)
+
+    # Code cached by python -O has no asserts, a later run without -O must not load it
+    write(tmp_path / "cached.py", MODULE.format(1))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path), os.getcwd()]))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    script = "import cached\ntry:\n    cached.f(0)\nexcept AssertionError:\n    print('assert')\n"
+    for flags, expected in ((["-O"], ""), ([], "assert")):
+        result = subprocess.run(
+            [sys.executable, *flags, "-c", script], env=env, capture_output=True, text=True, check=True
+        )
+        assert result.stdout.strip() == expected
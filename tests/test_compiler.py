@@ -0,0 +1,109 @@
+import os
+import traceback
+from ast import ExceptHandler, parse, stmt, walk
+from textwrap import dedent
+
+import pytest
+
+from joffpype.compiler import compile_source, compile_tree
+
+SOURCE = dedent(
+    '''
+    """A module"""
+    from joffpype import _, pipes
+
+
+    def helper(x):
+        return x * 2
+
+
+    @pipes
+    def piped(x):
+        """Doubles, then formats"""
+        y = x >> helper >> __ + 1
+
+        if y > 100:
+            label = "big"
+        elif y > 10:
+            label = "medium"
+        else:
+            label = "small"
+
+        try:
+            ratio = 1 / x
+        except ZeroDivisionError:
+            ratio = None
+        return f"{y!r:>5} {label} {ratio}"
+
+
+    @pipes
+    def fails(x):
+        return x >> helper >> __.missing
+    '''
+)
+
+
+def lines(source):
+    nodes = walk(parse(source))
+    return [(type(node).__name__, node.lineno) for node in nodes if isinstance(node, (stmt, ExceptHandler))]
+
+
+def run(source):
+    namespace = {}
+    exec(compile(source, "module.py", "exec"), namespace)
+    return namespace
+
+
+def test_unchanged_module():
+    assert compile_source(b"x = 1\n", "module.py") is None
+
+
+def test_compiled_module_runs_without_pipes():
+    generated = compile_source(SOURCE.encode(), "module.py")
+    assert "pipes" not in generated and ">>" not in generated
+    namespace = run(generated)
+    assert namespace["piped"](0) == "    1 small None"
+    assert namespace["piped"](10) == "   21 medium 0.1"
+    assert namespace["__doc__"] == "A module"
+
+
+def test_statements_keep_their_lines():
+    generated = compile_source(SOURCE.encode(), "module.py")
+    # The import of pipes and _ is dropped, and the decorators are gone
+    expected = [entry for entry in lines(SOURCE) if entry != ("ImportFrom", 3)]
+    assert lines(generated) == expected
+
+    namespace = run(generated)
+    with pytest.raises(AttributeError) as info:
+        namespace["fails"](1)
+    line = traceback.extract_tb(info.value.__traceback__)[-1].lineno
+    assert line == SOURCE.splitlines().index("    return x >> helper >> __.missing") + 1
+
+
+def test_longer_output_catches_up():
+    source = "if True: x = 1\ny = 2\n\nz = 3\n"
+    generated = compile_source(source.encode(), "module.py", whole_module=True)
+    # x = 1 moves to line 2 under its if, the blank line lets z = 3 catch up
+    assert lines(generated) == [("If", 1), ("Assign", 3), ("Assign", 4), ("Assign", 2)]
+
+
+def test_incremental_rebuild(tmp_path):
+    src = tmp_path / "src"
+    out = tmp_path / "out"
+    src.mkdir()
+    (src / "piped.py").write_text(SOURCE)
+    (src / "plain.py").write_text("x = 1  # kept\n")
+
+    assert compile_tree(str(src), str(out)) == ["piped.py", "plain.py"]
+    assert (out / "plain.py").read_text() == "x = 1  # kept\n"
+    assert compile_tree(str(src), str(out)) == []
+
+    # A touched but unchanged file is not regenerated, a changed one is
+    os.utime(src / "plain.py", ns=(0, 0))
+    (src / "piped.py").write_text(SOURCE + "\nz = 1 >> str\n")
+    assert compile_tree(str(src), str(out)) == ["piped.py"]
+
+    (src / "plain.py").unlink()
+    assert compile_tree(str(src), str(out)) == []
+    assert not (out / "plain.py").exists()
+    assert compile_tree(str(src), str(out), force=True) == ["piped.py"]
@@ -0,0 +1,81 @@
+import importlib
+import os
+import subprocess
+import sys
+
+import pytest
+
+import joffpype
+from joffpype.importer import PipeFinder
+
+MARKED = "# joffpype: pipes\nresult = 5 >> __ + 1 >> str\n"
+
+
+@pytest.fixture
+def hook(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    importlib.invalidate_caches()
+    finders = []
+
+    def install(*packages, **kwargs):
+        finders.append(joffpype.install(*packages, **kwargs))
+        return finders[-1]
+
+    yield install
+    joffpype.uninstall()
+    for name in [name for name in sys.modules if name.startswith("hooked")]:
+        del sys.modules[name]
+
+
+def test_marked_module_is_transformed(tmp_path, hook):
+    (tmp_path / "hooked_marked.py").write_text(MARKED)
+    hook()
+    assert importlib.import_module("hooked_marked").result == "6"
+
+
+def test_package_is_transformed(tmp_path, hook):
+    package = tmp_path / "hooked_package"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "etl.py").write_text("result = [3, 1, 2] >> sorted >> __[0]\n")
+    hook("hooked_package", marker=False)
+    assert importlib.import_module("hooked_package.etl").result == 1
+
+
+def test_unmarked_module_is_left_alone(tmp_path, hook):
+    (tmp_path / "hooked_plain.py").write_text("result = 5 >> 1\n")
+    hook()
+    assert importlib.import_module("hooked_plain").result == 2
+
+
+def test_site_packages_inside_the_standard_library_is_scanned(tmp_path):
+    # As in installations without a virtual environment
+    site = tmp_path / "lib" / "site-packages"
+    site.mkdir(parents=True)
+    (site / "marked.py").write_text(MARKED)
+    (tmp_path / "lib" / "stdlib_module.py").write_text(MARKED)
+
+    finder = PipeFinder()
+    finder._stdlib = (os.path.join(str(tmp_path / "lib"), ""),)
+    finder._site = (os.path.join(str(site), ""),)
+    assert finder._has_marker(str(site / "marked.py"))
+    assert not finder._has_marker(str(tmp_path / "lib" / "stdlib_module.py"))
+
+
+def test_optimized_code_is_not_loaded_without_optimization(tmp_path):
+    source = "# joffpype: pipes\ndef f(x):\n    assert x > 0\n    return x >> str\n"
+    (tmp_path / "hooked_asserts.py").write_text(source)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path), os.getcwd()]))
+    env.pop("JOFFPYPE_NO_CACHE", None)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["JOFFPYPE_CACHE_DIR"] = str(tmp_path / "cache")
+    script = (
+        "import joffpype\njoffpype.install()\nimport hooked_asserts\n"
+        "try:\n    hooked_asserts.f(0)\nexcept AssertionError:\n    print('assert')\n"
+    )
+    # The first run caches the module compiled with -O, without its asserts
+    for flags, expected in ((["-O"], ""), ([], "assert")):
+        result = subprocess.run(
+            [sys.executable, *flags, "-c", script], env=env, capture_output=True, text=True, check=True
+        )
+        assert result.stdout.strip() == expected
@@ -0,0 +1,66 @@
+from ast import parse, unparse
+
+from joffpype import lazy, pipes
+from joffpype.superpipe import _transform
+
+
+def both(a, b):
+    return [a, b]
+
+
+@pipes
+def fused(n):
+    return range(n) >> lazy.filter(lambda x: x % 3 == 0) >> lazy.map(lambda x: x * x) >> lazy.take(3) >> list
+
+
+@pipes
+def bound_source():
+    return sum(range(3)) >> both(__, __) >> lazy.map(lambda x: x * 10) >> list
+
+
+def test_stages_are_fused():
+    assert fused(20) == [0, 9, 36]
+    code = unparse(_transform(parse("y = xs >> lazy.filter(lambda x: x > 0) >> lazy.map(lambda x: x * 2)")))
+    assert "lazy" not in code
+
+
+def test_bound_source_is_not_fused():
+    # Assignment expressions are not allowed in the iterable of a generator expression
+    assert bound_source() == [30, 30]
+
+
+def test_unfused_stages():
+    assert list(lazy.flat_map([1, 2], lambda x: [x, x])) == [1, 1, 2, 2]
+    assert list(lazy.chunk(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(lazy.take(range(10), 2)) == [0, 1]
+
+
+@pipes
+def builtin_chain(xs):
+    return xs >> filter(lambda x: x > 0, __) >> map(lambda x: x * 2, __) >> map(str, __) >> list
+
+
+@pipes
+def builtin_bound_source():
+    return sum(range(3)) >> both(__, __) >> map(lambda x: x * 10, __) >> list
+
+
+@pipes
+def builtin_outside_pipe(data):
+    return map(lambda x: x + 1, (y := data)), y
+
+
+def test_builtin_stages_are_fused():
+    assert builtin_chain([-1, 2, 3]) == ["4", "6"]
+    code = unparse(_transform(parse("y = xs >> filter(lambda x: x > 0, __) >> map(lambda x: x * 2, __)")))
+    assert "map" not in code and "filter" not in code
+
+
+def test_builtin_bound_source_is_not_fused():
+    assert builtin_bound_source() == [30, 30]
+
+
+def test_builtin_calls_outside_pipes_are_kept():
+    result, data = builtin_outside_pipe([1, 2])
+    assert isinstance(result, map)
+    assert list(result) == [2, 3] and data == [1, 2]
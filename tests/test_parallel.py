@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from joffpype.parallel import executor, pforeach, pmap
+
+
+def slow_for_small(x):
+    # Earlier elements finish later, so that completion order differs from input order
+    time.sleep(0.01 * (5 - x))
+    return x * 2
+
+
+def test_results_keep_the_order_of_the_input():
+    assert list(pmap(range(5), slow_for_small, workers=5)) == [0, 2, 4, 6, 8]
+    assert list(pmap(iter(range(100)), str, workers=3, chunksize=7)) == [str(x) for x in range(100)]
+
+
+def test_unordered_results_come_as_they_are_ready():
+    results = list(pmap(range(5), slow_for_small, workers=5, ordered=False))
+    assert sorted(results) == [0, 2, 4, 6, 8]
+    assert results != [0, 2, 4, 6, 8]
+
+
+def test_process_mode():
+    assert list(pmap(range(-20, 20), abs, workers=2, mode="process")) == [abs(x) for x in range(-20, 20)]
+
+
+def test_closing_early_cancels_pending_chunks():
+    calls = []
+
+    def record(x):
+        calls.append(x)
+        time.sleep(0.01)
+        return x
+
+    results = pmap(range(1000), record, workers=1, prefetch=2)
+    assert next(results) == 0
+    results.close()
+    # The pool runs its queue in order, once this is done every chunk that wasn't cancelled has run
+    executor("thread", 1).submit(lambda: None).result()
+    assert len(calls) <= 3
+
+
+def test_pforeach_applies_to_every_element():
+    seen = []
+    lock = threading.Lock()
+
+    def add(x):
+        with lock:
+            seen.append(x)
+
+    assert pforeach(range(50), add, workers=4) is None
+    assert sorted(seen) == list(range(50))
+
+
+@pytest.mark.parametrize("option", ["chunksize", "prefetch"])
+def test_options_below_one_are_rejected(option):
+    with pytest.raises(ValueError):
+        pmap(range(5), str, **{option: 0})
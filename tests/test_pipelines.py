@@ -0,0 +1,94 @@
+import pickle
+
+import pytest
+
+from joffpype import memo, pipeline, pipelines, pipes
+from joffpype.pipelines import Pipeline
+
+
+def add_one(x):
+    return x + 1
+
+
+def double(x):
+    return x * 2
+
+
+def test_stages_are_applied_from_left_to_right():
+    p = pipeline(add_one, double, str)
+    assert p(3) == "8"
+    assert list(p.map([0, 1])) == ["2", "4"]
+    assert pipeline()(5) == 5
+
+
+def test_non_callable_stages_are_rejected():
+    with pytest.raises(TypeError):
+        pipeline(add_one, 5)
+
+
+def test_nested_pipelines_are_flattened():
+    inner = pipeline(add_one, double)
+    outer = pipeline(inner, str, inner)
+    assert outer.stages == (add_one, double, str, add_one, double)
+    assert repr(inner) == "Pipeline(add_one, double)"
+
+
+def test_pipelines_pickle_by_their_stages():
+    p = pickle.loads(pickle.dumps(pipeline(add_one, double)))
+    assert isinstance(p, Pipeline)
+    assert p.stages == (add_one, double)
+    assert p(1) == 4
+
+
+@pipes
+def built_with_pipes(scale):
+    return pipeline(__ >> add_one >> __ * scale >> divmod(7))
+
+
+def test_pipe_syntax_with_the_input_placeholder():
+    p = built_with_pipes(3)
+    assert len(p.stages) == 1
+    assert p(1) == divmod(6, 7)
+    assert p(2) == divmod(9, 7)
+
+
+def test_memo_without_ttl_caches_results():
+    calls = []
+
+    def stage(x):
+        calls.append(x)
+        return x * 2
+
+    cached = memo(stage, maxsize=2)
+    assert [cached(1), cached(1), cached(2)] == [2, 2, 4]
+    assert calls == [1, 2]
+
+
+def test_memo_with_ttl_expires_and_is_bounded(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(pipelines, "monotonic", lambda: now[0])
+    calls = []
+
+    def stage(x):
+        calls.append(x)
+        return x * 2
+
+    cached = memo(stage, maxsize=2, ttl=10)
+    assert cached(1) == 2 and cached(1) == 2
+    assert calls == [1]
+
+    now[0] = 11.0
+    assert cached(1) == 2
+    assert calls == [1, 1]
+
+    # 1 is evicted as the least recently used once a third value comes in
+    cached(2)
+    cached(3)
+    cached(1)
+    assert calls == [1, 1, 2, 3, 1]
+    cached(3)
+    assert calls == [1, 1, 2, 3, 1]
+
+    cached.cache_clear()
+    cached(3)
+    assert calls == [1, 1, 2, 3, 1, 3]
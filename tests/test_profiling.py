@@ -0,0 +1,96 @@
+import io
+from ast import parse, unparse
+from textwrap import dedent
+
+import pytest
+
+from joffpype import pipes, profiling, stats
+from joffpype.superpipe import _transform
+
+SOURCE = "def f(x):\n    return x >> __ + 1 >> str\n"
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    enabled = profiling.decoration_enabled(), profiling.stages_enabled()
+    profiling.reset()
+    yield
+    profiling.enable(*enabled)
+    profiling.reset()
+
+
+def run_instrumented(source: str) -> dict:
+    namespace = {}
+    profiling.install_hooks(namespace)
+    exec(compile(_transform(parse(dedent(source)), stage_file="mod.py"), "mod.py", "exec"), namespace)
+    return namespace
+
+
+def test_own_time_excludes_the_stages_to_the_left(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(profiling, "perf_counter", lambda: now[0])
+    # The left stage ran from 1 to 3, the stage taking its result from 0 to 4
+    now[0] = 3.0
+    assert profiling.stage("left", "right", 1.0, "a") == "a"
+    now[0] = 4.0
+    assert profiling.stage("right", None, 0.0, "b") == "b"
+
+    assert stats()["stages"] == {
+        "left": {"calls": 1, "total": 2.0, "own": 2.0},
+        "right": {"calls": 1, "total": 4.0, "own": 2.0},
+    }
+
+
+def test_stages_are_recorded_with_their_parent():
+    f = run_instrumented(SOURCE)["f"]
+    assert [f(1), f(2)] == ["2", "3"]
+
+    stages = stats()["stages"]
+    assert sorted(stages) == ["mod.py:2:16 __ + 1", "mod.py:2:26 str"]
+    assert all(entry["calls"] == 2 for entry in stages.values())
+    outer = stages["mod.py:2:26 str"]
+    inner = stages["mod.py:2:16 __ + 1"]
+    assert outer["own"] == pytest.approx(outer["total"] - inner["total"])
+
+
+def decorated(x):
+    return x >> __ + 1
+
+
+def test_decoration_phases_are_recorded():
+    profiling.enable(decoration=True)
+    assert pipes(decorated)(1) == 2
+    ((name, phases),) = stats()["decoration"].items()
+    assert name.endswith(" decorated")
+    assert {"getsource", "parse", "transform", "compile", "exec"} <= set(phases)
+    assert all(seconds >= 0 for seconds in phases.values())
+
+
+def test_nothing_is_recorded_when_disabled():
+    profiling.disable()
+    assert pipes(decorated)(1) == 2
+    assert stats() == {"decoration": {}, "stages": {}}
+
+
+def test_report_lists_decorations_and_stages():
+    profiling.enable(decoration=True)
+    pipes(decorated)
+    run_instrumented(SOURCE)["f"](1)
+    out = io.StringIO()
+    profiling.report(out)
+    text = out.getvalue()
+    assert "Decoration: 1 objects" in text and " decorated (cache " in text
+    assert "Stages: 2" in text and "mod.py:2:26 str" in text
+
+
+def test_code_is_unchanged_without_stage_profiling():
+    plain = unparse(_transform(parse(SOURCE)))
+    assert unparse(_transform(parse(SOURCE), stage_file=None)) == plain
+    assert profiling.STAGE_NAME not in plain and profiling.CLOCK_NAME not in plain
+    assert unparse(_transform(parse(SOURCE), stage_file="mod.py")) != plain
+
+    profiling.disable()
+    off = pipes(decorated).__code__
+    profiling.enable(decoration=True)
+    on = pipes(decorated).__code__
+    assert (on.co_code, on.co_names, on.co_consts) == (off.co_code, off.co_names, off.co_consts)
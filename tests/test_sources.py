@@ -0,0 +1,81 @@
+import importlib
+import os
+import sys
+from textwrap import dedent
+
+import pytest
+
+from joffpype import sources
+
+
+def write(path, source: str) -> None:
+    path.write_text(dedent(source))
+    # Make sure the change is visible even on file systems with coarse timestamps
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+    """Imports modules from `tmp_path`, with the on-disk cache enabled in its own directory"""
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delenv("JOFFPYPE_NO_CACHE", raising=False)
+    monkeypatch.setenv("JOFFPYPE_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(sys, "dont_write_bytecode", False)
+    names = []
+
+    def load(name):
+        for loaded in names:
+            sys.modules.pop(loaded, None)
+        names.append(name)
+        importlib.invalidate_caches()
+        return importlib.import_module(name)
+
+    yield load
+    for name in names + ["lib"]:
+        sys.modules.pop(name, None)
+
+
+CLASS = """
+class C:
+    def m(self, x):
+        return x >> __ + {}
+"""
+
+
+def test_class_decorated_from_another_file_follows_its_own_file(tmp_path, modules):
+    write(tmp_path / "lib.py", CLASS.format(1))
+    write(tmp_path / "user.py", "import lib\nfrom joffpype import pipes\nC = pipes(lib.C)\n")
+    assert modules("user").C().m(1) == 2
+
+    write(tmp_path / "lib.py", CLASS.format(100))
+    sys.modules.pop("lib")
+    assert modules("user").C().m(1) == 101
+
+
+def test_definitions_are_located_by_qualified_name_and_line(tmp_path):
+    path = tmp_path / "defs.py"
+    write(
+        path,
+        """
+        def f():
+            pass
+
+        class C:
+            @staticmethod
+            def f():
+                def inner():
+                    pass
+
+        def f():
+            return 2
+        """,
+    )
+    assert sources.definition_source(str(path), "f", 2) == ("def f():\n    pass\n", 2)
+    assert sources.definition_source(str(path), "f", 11) == ("def f():\n    return 2\n", 11)
+    assert sources.definition_source(str(path), "C.f", 6)[1] == 6
+    assert sources.definition_source(str(path), "C.f.<locals>.inner", 8)[1] == 8
+    # Without a line, only a unique name is enough
+    assert sources.definition_source(str(path), "C", None)[1] == 5
+    assert sources.definition_source(str(path), "f", None) is None
+    assert sources.definition_source(str(path), "f", 4) is None
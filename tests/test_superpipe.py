@@ -0,0 +1,282 @@
+import asyncio
+from ast import parse, unparse
+from textwrap import dedent
+
+from joffpype import _, pipes
+from joffpype.superpipe import TEMP_PREFIX, _transform
+
+
+def run(source: str, **namespace) -> dict:
+    """Transforms `source` as a whole module and executes it, returns its namespace"""
+    code = compile(_transform(parse(dedent(source))), "<test>", "exec")
+    exec(code, namespace)
+    return namespace
+
+
+def transformed(source: str) -> str:
+    return unparse(_transform(parse(dedent(source))))
+
+
+class Counter:
+    """Records calls, so that tests can check how often and in which order things are evaluated"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, name, value):
+        def f(*args):
+            self.calls.append(name)
+            return value
+
+        return f
+
+
+@pipes
+def first_argument(x):
+    return x >> divmod(7)
+
+
+@pipes
+def last_argument(x):
+    return x << divmod(7)
+
+
+@pipes
+def substituted(x):
+    return x >> __ * 2 >> str >> __ + "!"
+
+
+def test_rshift_inserts_first_and_lshift_appends():
+    assert first_argument(2) == divmod(2, 7)
+    assert last_argument(2) == divmod(7, 2)
+    assert substituted(3) == "6!"
+
+
+def test_left_side_is_evaluated_once():
+    counter = Counter()
+    ns = run(
+        """
+        def f():
+            return expensive() >> (__, __, __)
+        result = f()
+        """,
+        expensive=counter("expensive", 5),
+    )
+    assert ns["result"] == (5, 5, 5)
+    assert counter.calls == ["expensive"]
+
+
+def test_module_level_does_not_bind():
+    counter = Counter()
+    ns = run("result = expensive() >> (__, __)", expensive=counter("expensive", 5))
+    assert ns["result"] == (5, 5)
+    assert not any(name.startswith(TEMP_PREFIX) for name in ns)
+
+
+def test_names_and_constants_are_not_bound():
+    assert TEMP_PREFIX not in transformed("x >> (__, __)")
+    assert TEMP_PREFIX not in transformed("5 >> (__, __)")
+    assert TEMP_PREFIX not in transformed("(1, -2) >> (__, __)")
+
+
+def test_evaluation_order_is_kept_when_inlining():
+    counter = Counter()
+    ns = run("result = g() >> (lambda v: f() + v)", f=counter("f", 1), g=counter("g", 2))
+    assert ns["result"] == 3
+    assert counter.calls == ["g", "f"]
+
+
+def test_names_are_read_after_the_left_side_when_inlining():
+    ns = run(
+        """
+        counter = 1
+        def bump():
+            global counter
+            counter = 99
+            return 1
+        result = bump() >> (lambda v: counter + v)
+        """
+    )
+    assert ns["result"] == 100
+
+
+def test_left_side_is_evaluated_when_lambda_ignores_it():
+    counter = Counter()
+    ns = run("result = g() >> (lambda v: 0)", g=counter("g", 2))
+    assert ns["result"] == 0
+    assert counter.calls == ["g"]
+
+
+def test_left_side_is_evaluated_once_when_conditional():
+    counter = Counter()
+    ns = run("result = g() >> (lambda v: x and v)", g=counter("g", 2), x=0)
+    assert ns["result"] == 0
+    assert counter.calls == ["g"]
+
+
+def test_lambda_and_identity_stages_are_inlined():
+    assert transformed("y = x >> (lambda v: v * 2)") == "y = x * 2"
+    assert transformed("y = x >> (lambda v: v) >> __ >> str") == "y = str(x)"
+
+
+def test_class_body_does_not_bind_or_inline():
+    counter = Counter()
+    ns = run(
+        """
+        y = 1
+        class C:
+            y = 100
+            pair = expensive() >> (__, __)
+            z = 5 >> (lambda v: v + y)
+        """,
+        expensive=counter("expensive", 5),
+    )
+    C = ns["C"]
+    assert C.pair == (5, 5)
+    # The lambda sees the global y, not the class attribute
+    assert C.z == 6
+    assert not any(name.startswith(TEMP_PREFIX) for name in vars(C))
+
+
+def test_method_defaults_do_not_leak_temporaries_into_class():
+    ns = run(
+        """
+        class C:
+            def m(self, a=expensive() >> (__, __)):
+                return a
+        """,
+        expensive=Counter()("expensive", 5),
+    )
+    C = ns["C"]
+    assert C().m() == (5, 5)
+    assert not any(name.startswith(TEMP_PREFIX) for name in vars(C))
+
+
+def test_comprehension_iterable():
+    ns = run("result = [v for v in expensive() >> (__, __)]", expensive=Counter()("expensive", 5))
+    assert ns["result"] == [5, 5]
+
+
+def test_comprehension_element_binds():
+    counter = Counter()
+    ns = run(
+        """
+        def g():
+            return [f(v) >> (__, __) for v in range(2)]
+        result = g()
+        """,
+        f=counter("f", 1),
+    )
+    assert ns["result"] == [(1, 1), (1, 1)]
+    assert counter.calls == ["f", "f"]
+
+
+@pipes
+def infix(x):
+    return x |_| abs |_| str
+
+
+def runtime_infix(x):
+    return x |_| abs |_| str
+
+
+def test_infix_is_lowered_to_calls():
+    assert transformed("y = x |_| abs |_| str") == "y = str(abs(x))"
+    assert transformed("y = x %_% abs %_% str") == "y = str(abs(x))"
+    assert infix(-3) == "3"
+    assert runtime_infix(-3) == "3"
+
+
+async def double(x):
+    await asyncio.sleep(0)
+    return x * 2
+
+
+@pipes
+async def awaits_module_coroutines(x):
+    return x >> double >> __ + 1
+
+
+@pipes
+async def awaits_marked_stages(x):
+    return x >> await double >> str
+
+
+@pipes
+def generator_stays_sync(xs):
+    return list(x >> str for x in xs)
+
+
+def test_async_stages_are_awaited():
+    assert asyncio.run(awaits_module_coroutines(2)) == 5
+    assert asyncio.run(awaits_marked_stages(2)) == "4"
+    assert generator_stays_sync([1, 2]) == ["1", "2"]
+
+
+def test_profiled_stages_keep_their_values():
+    tree = _transform(parse("result = 5 >> __ + 1 >> str"), stage_file="<test>")
+    ns = {"_joffpype_clock": lambda: 0.0, "_joffpype_stage": lambda key, parent, start, value: value}
+    exec(compile(tree, "<test>", "exec"), ns)
+    assert ns["result"] == "6"
+
+
+def test_other_operators_are_left_alone():
+    assert transformed("y = a >> b") == "y = b(a)"
+    assert transformed("y = a | b % c + 1") == "y = a | b % c + 1"
+
+
+@pipes
+async def awaits_coroutines_defined_later(x):
+    return x >> triple >> str
+
+
+async def triple(x):
+    return x * 3
+
+
+def test_coroutines_defined_later_in_the_module_are_awaited():
+    assert asyncio.run(awaits_coroutines_defined_later(2)) == "6"
+
+
+@pipes
+async def shadowed_by_parameter(x, double=str):
+    return x >> double
+
+
+@pipes
+async def shadowed_by_assignment(x):
+    double = str
+    return x >> double
+
+
+@pipes
+async def gathers_comprehension(xs):
+    return await ([x >> double for x in xs] >> asyncio.gather(*__))
+
+
+def test_shadowed_coroutine_names_are_not_awaited():
+    assert asyncio.run(shadowed_by_parameter(2)) == "2"
+    assert asyncio.run(shadowed_by_assignment(2)) == "2"
+    assert "await" in transformed(
+        """
+        async def double(x):
+            pass
+        async def f(x, double=str):
+            async def g():
+                async def double(y):
+                    pass
+                return x >> double
+        """
+    )
+
+
+def test_comprehensions_are_not_awaited():
+    assert asyncio.run(gathers_comprehension([1, 2])) == [2, 4]
+    assert "await" not in transformed(
+        """
+        async def double(x):
+            pass
+        async def f(xs):
+            return [x >> double for x in xs], {x >> double for x in xs}, {x: x >> double for x in xs}
+        """
+    )
@@ -0,0 +1,59 @@
+import pytest
+
+from joffpype import lazy
+from joffpype.utils import cube, is_even, is_falsy, is_none, is_not_none, is_odd, square
+
+np = pytest.importorskip("numpy")
+
+
+def same(a, b) -> bool:
+    # NaN never equals itself, compare representations instead
+    return list(map(repr, a)) == list(map(repr, b))
+
+
+def test_plain_values():
+    assert is_none(None) and not is_none(0)
+    assert is_not_none(0) and not is_not_none(None)
+    assert is_even(2) and is_odd(3)
+    assert is_falsy("") and not is_falsy("a")
+    assert square(3) == 9 and cube(2) == 8
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        [1.0, float("nan"), 0.0],
+        [1, 2, 3],
+        ["", "a"],
+        [None, "a", 0, float("nan")],
+        [True, False],
+    ],
+)
+@pytest.mark.parametrize("predicate", [is_none, is_not_none, is_falsy])
+def test_ndarray_matches_elementwise(values, predicate):
+    array = np.array(values, dtype=object if None in values else None)
+    assert list(predicate(array)) == [predicate(value) for value in values]
+    assert same(lazy.filter(array, predicate), [value for value in array if predicate(value)])
+
+
+def test_nan_is_not_none():
+    pd = pytest.importorskip("pandas")
+    assert list(lazy.filter(pd.Series([1.0, None, float("nan")]), is_none)) == []
+
+
+def test_numbers():
+    array = np.arange(5)
+    assert list(is_even(array)) == [is_even(value) for value in range(5)]
+    assert list(square(array)) == [0, 1, 4, 9, 16]
+
+
+@pytest.mark.parametrize("predicate", [is_none, is_not_none, is_falsy])
+def test_pandas_matches_elementwise(predicate):
+    pd = pytest.importorskip("pandas")
+    for values in ([1.0, None, float("nan")], ["", "a", None], [0, 1]):
+        series = pd.Series(values)
+        assert list(predicate(series)) == [predicate(value) for value in series]
+        assert same(lazy.filter(series, predicate), [value for value in series if predicate(value)])
+
+    frame = pd.DataFrame({"a": [None, "x"], "b": [0.0, float("nan")]})
+    assert predicate(frame).values.tolist() == [[predicate(value) for value in row] for row in frame.values]